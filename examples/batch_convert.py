@@ -2,45 +2,179 @@
 Batch conversion example for paper2epub
 """
 
+import argparse
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import partial
+from multiprocessing.util import Finalize
 from pathlib import Path
+from typing import Optional
+
+import torch
+
 from paper2epub import Paper2EpubConverter
 
+MODEL_TAG = "0.1.0-small"
+
+# Converter of the current worker process, built once by _init_worker
+_worker_converter: Optional[Paper2EpubConverter] = None
+
+
+def _init_worker(threads: int):
+    """Build the worker process's converter, closed when the process exits."""
+    global _worker_converter
+    # Split cores between workers instead of every process using all of them
+    torch.set_num_threads(threads)
+    _worker_converter = Paper2EpubConverter(model_tag=MODEL_TAG, device="cpu")
+    # multiprocessing runs finalizers on worker exit, where atexit hooks are skipped
+    Finalize(_worker_converter, _worker_converter.close, exitpriority=10)
+
+
+def _worker(pdf_path: Path, epub_output: Path) -> Path:
+    """Convert one PDF with the worker process's converter, keeping its model loaded."""
+    return _worker_converter.convert(pdf_path=pdf_path, output_path=epub_output)
+
+
+def _convert_parallel(pdf_files, output_path: Path, workers: int):
+    """Convert PDFs concurrently, one converter per worker process (CPU only)."""
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(threads,)
+    ) as pool:
+        futures = {
+            pool.submit(_worker, pdf_file, output_path / f"{pdf_file.stem}.epub"): pdf_file
+            for pdf_file in pdf_files
+        }
+        for i, future in enumerate(as_completed(futures), 1):
+            pdf_file = futures[future]
+            try:
+                epub_output = future.result()
+                print(f"[{i}/{len(pdf_files)}] ✓ Success: {epub_output}")
+            except Exception as e:
+                print(f"[{i}/{len(pdf_files)}] ✗ Failed: {pdf_file.name}: {e}")
+
+
+async def _convert_serial(converter: Paper2EpubConverter, pdf_files, output_path: Path):
+    """
+    Convert PDFs one at a time on the shared model, writing each EPUB and
+    extracting the next PDF's figures while the current PDF is being inferred.
+    """
+    loop = asyncio.get_running_loop()
+    # Hand off at most one finished document so memory stays bounded
+    finished: asyncio.Queue = asyncio.Queue(maxsize=1)
+
+    # One thread keeps the model busy, the other zips and writes EPUBs
+    infer_pool = ThreadPoolExecutor(max_workers=1)
+    write_pool = ThreadPoolExecutor(max_workers=1)
+
+    def prefetch_figures(pdf_file: Path):
+        # Figures come from the embedded image streams, so they are read on the
+        # write thread while Nougat runs. The text layer probe also uses PyMuPDF,
+        # which is not thread-safe, so leave extraction to the converter then.
+        if not converter.extract_figures or converter.text_layer:
+            return None
+        return loop.run_in_executor(write_pool, converter.figure_extractor.extract_images, pdf_file)
+
+    async def writer():
+        while True:
+            item = await finished.get()
+            if item is None:
+                return
+            pdf_file, pages, images = item
+            epub_output = output_path / f"{pdf_file.stem}.epub"
+            try:
+                await loop.run_in_executor(
+                    write_pool,
+                    partial(
+                        converter.markdown_to_epub,
+                        markdown_content=pages,
+                        output_path=epub_output,
+                        title=pdf_file.stem,
+                        images=images,
+                    ),
+                )
+                print(f"✓ Success: {epub_output}")
+            except Exception as e:
+                print(f"✗ Failed: {pdf_file.name}: {e}")
+
+    writer_task = asyncio.create_task(writer())
+    pending = prefetch_figures(pdf_files[0])
+    try:
+        for i, pdf_file in enumerate(pdf_files, 1):
+            print(f"\n[{i}/{len(pdf_files)}] Converting: {pdf_file.name}")
+
+            figures = None
+            if pending is not None:
+                try:
+                    figures = await pending
+                except Exception as e:
+                    print(f"  Figure extraction failed: {e}")
+                    figures = []
+                # Start on the next PDF's figures while Nougat runs on this one
+                pending = prefetch_figures(pdf_files[i]) if i < len(pdf_files) else None
 
-def batch_convert(input_dir: str, output_dir: str = "output"):
+            try:
+                pages, images = await loop.run_in_executor(
+                    infer_pool, partial(converter.extract_document, pdf_file, figures=figures)
+                )
+            except Exception as e:
+                print(f"✗ Failed: {pdf_file.name}: {e}")
+                continue
+            await finished.put((pdf_file, pages, images))
+
+        await finished.put(None)
+        await writer_task
+    finally:
+        infer_pool.shutdown()
+        write_pool.shutdown()
+
+
+def batch_convert(input_dir: str, output_dir: str = "output", workers: int = 0):
     """
     Convert all PDFs in a directory to EPUB format.
 
     Args:
         input_dir: Directory containing PDF files
         output_dir: Directory for output EPUB files
+        workers: Worker processes for CPU conversion (0 = min(cpu_count, 4))
     """
     input_path = Path(input_dir)
     output_path = Path(output_dir)
     output_path.mkdir(parents=True, exist_ok=True)
 
-    # Initialize converter once (reuse for all files)
-    converter = Paper2EpubConverter(model_tag="0.1.0-small")
-
     # Find all PDF files
     pdf_files = list(input_path.glob("*.pdf"))
     print(f"Found {len(pdf_files)} PDF files")
+    if not pdf_files:
+        return
 
-    # Convert each PDF
-    for i, pdf_file in enumerate(pdf_files, 1):
-        print(f"\n[{i}/{len(pdf_files)}] Converting: {pdf_file.name}")
+    # Initialize converter once (reuse for all files); the model stays loaded
+    # until the with-block exits
+    with Paper2EpubConverter(model_tag=MODEL_TAG) as converter:
+        if converter.device == "cpu":
+            # No GPU to share, so convert several PDFs at once
+            workers = workers or min(os.cpu_count() or 1, 4)
+            workers = min(workers, len(pdf_files))
+            if workers > 1:
+                print(f"Converting on CPU with {workers} worker processes")
+                _convert_parallel(pdf_files, output_path, workers)
+                return
 
-        try:
-            epub_output = output_path / f"{pdf_file.stem}.epub"
-            converter.convert(
-                pdf_path=pdf_file,
-                output_path=epub_output,
-            )
-            print(f"✓ Success: {epub_output}")
-        except Exception as e:
-            print(f"✗ Failed: {e}")
-            continue
+        asyncio.run(_convert_serial(converter, pdf_files, output_path))
 
 
 if __name__ == "__main__":
-    # Convert all PDFs in 'papers' directory
-    batch_convert("papers", "output")
+    parser = argparse.ArgumentParser(description="Convert all PDFs in a directory to EPUB")
+    parser.add_argument("input_dir", nargs="?", default="papers", help="Directory of PDFs")
+    parser.add_argument("output_dir", nargs="?", default="output", help="Output directory")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Worker processes for CPU conversion (default: min(cpu_count, 4))",
+    )
+    args = parser.parse_args()
+
+    batch_convert(args.input_dir, args.output_dir, workers=args.workers)
@@ -0,0 +1,237 @@
+"""
+Optional inference backends for the Nougat vision encoder
+"""
+
+import inspect
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import List, Optional, Union
+
+import numpy as np
+import torch
+
+from paper2epub.config import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ["torch", "onnx", "tensorrt"]
+
+# ONNX Runtime CUDA execution provider settings
+CUDA_PROVIDER_OPTIONS = {
+    "cudnn_conv_algo_search": "EXHAUSTIVE",
+    "do_copy_in_default_stream": 1,
+}
+
+# Batch sizes the TensorRT engine is built for (optimized for the middle one)
+TENSORRT_BATCH_SIZES = (1, 4, 10)
+
+
+def tensorrt_provider_options(input_size: List[int]) -> dict:
+    """
+    Build ONNX Runtime TensorRT execution provider settings.
+
+    Args:
+        input_size: Encoder input size as [height, width]
+
+    Returns:
+        Provider options with an fp16 engine cached under CACHE_DIR
+    """
+    height, width = input_size
+    min_batch, opt_batch, max_batch = TENSORRT_BATCH_SIZES
+    return {
+        "trt_fp16_enable": True,
+        "trt_engine_cache_enable": True,
+        "trt_engine_cache_path": str(CACHE_DIR / "tensorrt"),
+        "trt_profile_min_shapes": f"image:{min_batch}x3x{height}x{width}",
+        "trt_profile_opt_shapes": f"image:{opt_batch}x3x{height}x{width}",
+        "trt_profile_max_shapes": f"image:{max_batch}x3x{height}x{width}",
+    }
+
+
+def export_encoder_onnx(
+    encoder: torch.nn.Module,
+    input_size: List[int],
+    onnx_path: Union[str, Path],
+) -> Path:
+    """
+    Export the Nougat encoder to ONNX with a dynamic batch axis.
+
+    Args:
+        encoder: Nougat encoder module (in fp32)
+        input_size: Encoder input size as [height, width]
+        onnx_path: Destination ONNX file
+
+    Returns:
+        Path to the exported ONNX file
+    """
+    onnx_path = Path(onnx_path)
+    onnx_path.parent.mkdir(parents=True, exist_ok=True)
+
+    device = next(encoder.parameters()).device
+    dummy = torch.zeros(1, 3, *input_size, device=device)
+
+    # Newer PyTorch defaults to the dynamo exporter, which needs onnxscript
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        kwargs["dynamo"] = False
+
+    # Export next to the cache and rename it into place, so an interrupted export
+    # never leaves a truncated model that later runs would load
+    fd, tmp_name = tempfile.mkstemp(dir=onnx_path.parent, suffix=".onnx.tmp")
+    os.close(fd)
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                encoder,
+                dummy,
+                tmp_name,
+                input_names=["image"],
+                output_names=["last_hidden_state"],
+                dynamic_axes={"image": {0: "batch"}, "last_hidden_state": {0: "batch"}},
+                opset_version=17,
+                **kwargs,
+            )
+        os.replace(tmp_name, onnx_path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+    logger.info(f"Exported Nougat encoder to ONNX: {onnx_path}")
+    return onnx_path
+
+
+class OnnxEncoder:
+    """
+    Encoder forward pass backed by an ONNX Runtime session.
+
+    Inputs and outputs are bound to the tensors' memory with IO binding, so
+    CUDA batches stay on the GPU. The export is fp32, so half-precision
+    inputs are upcast on the device and the output is cast back.
+    """
+
+    def __init__(
+        self,
+        onnx_path: Union[str, Path],
+        device: str = "cpu",
+        tensorrt_options: Optional[dict] = None,
+    ):
+        """
+        Initialize the ONNX Runtime session.
+
+        Args:
+            onnx_path: Path to exported encoder ONNX file
+            device: Device the surrounding model runs on
+            tensorrt_options: TensorRT execution provider settings, or None
+                to run on the CUDA/CPU providers only
+        """
+        import onnxruntime as ort
+
+        available = ort.get_available_providers()
+        providers: list = ["CPUExecutionProvider"]
+        if device == "cuda" and "CUDAExecutionProvider" in available:
+            providers.insert(0, ("CUDAExecutionProvider", CUDA_PROVIDER_OPTIONS))
+        if tensorrt_options is not None:
+            if device == "cuda" and "TensorrtExecutionProvider" in available:
+                providers.insert(0, ("TensorrtExecutionProvider", tensorrt_options))
+            else:
+                logger.warning("TensorRT execution provider unavailable, using ONNX Runtime")
+
+        self.session = ort.InferenceSession(str(onnx_path), providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+
+        # Devices whose memory the session can read directly
+        self.bind_devices = {"cpu"}
+        if {"CUDAExecutionProvider", "TensorrtExecutionProvider"} & set(
+            self.session.get_providers()
+        ):
+            self.bind_devices.add("cuda")
+
+        # Output shape after the batch axis, which IO binding needs to allocate
+        # the result. The export leaves it symbolic, so it is taken from the
+        # first (unbound) run; the encoder input size is fixed
+        self.output_name = self.session.get_outputs()[0].name
+        self.output_shape: Optional[tuple] = None
+
+    def __call__(self, image_tensors: torch.Tensor) -> torch.Tensor:
+        """Run the encoder, returning hidden states on the input's device and dtype."""
+        device = image_tensors.device
+        if self.output_shape is None or device.type not in self.bind_devices:
+            inputs = image_tensors.detach().float().cpu().numpy()
+            (hidden,) = self.session.run(None, {self.input_name: inputs})
+            self.output_shape = tuple(hidden.shape[1:])
+            return torch.from_numpy(hidden).to(device, dtype=image_tensors.dtype)
+
+        inputs = image_tensors.detach().float().contiguous()
+        hidden = torch.empty((len(inputs), *self.output_shape), dtype=torch.float32, device=device)
+        device_id = device.index or 0
+
+        binding = self.session.io_binding()
+        binding.bind_input(
+            self.input_name,
+            device.type,
+            device_id,
+            np.float32,
+            tuple(inputs.shape),
+            inputs.data_ptr(),
+        )
+        binding.bind_output(
+            self.output_name,
+            device.type,
+            device_id,
+            np.float32,
+            tuple(hidden.shape),
+            hidden.data_ptr(),
+        )
+        if device.type == "cuda":
+            # ONNX Runtime uses its own stream, so let pending PyTorch work finish
+            torch.cuda.current_stream(device).synchronize()
+        self.session.run_with_iobinding(binding)
+        binding.synchronize_outputs()
+        return hidden.to(image_tensors.dtype)
+
+
+def enable_onnx_encoder(model, model_tag: str, device: str, tensorrt: bool = False) -> bool:
+    """
+    Replace the Nougat encoder forward pass with ONNX Runtime.
+
+    The exported encoder is cached under CACHE_DIR per model tag. Must be
+    called while the model is still in fp32. Once ONNX Runtime takes over, the
+    encoder's PyTorch weights are dropped so they are not cast and kept resident.
+
+    Args:
+        model: Loaded NougatModel
+        model_tag: Nougat model version, used as the cache key
+        device: Device the model runs on
+        tensorrt: Run the encoder through the TensorRT execution provider
+            (fp16 engine, built on first use and cached)
+
+    Returns:
+        True if the ONNX encoder is active, False if PyTorch is kept
+    """
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        logger.warning(
+            "onnxruntime not installed, using PyTorch backend. "
+            "Install with: pip install paper2epub[onnx]"
+        )
+        return False
+
+    onnx_path = CACHE_DIR / f"nougat-{model_tag}-encoder.onnx"
+    tensorrt_options = tensorrt_provider_options(model.encoder.input_size) if tensorrt else None
+    try:
+        if not onnx_path.exists():
+            export_encoder_onnx(model.encoder, model.encoder.input_size, onnx_path)
+        model.encoder.forward = OnnxEncoder(onnx_path, device, tensorrt_options)
+    except Exception as e:
+        logger.warning(f"ONNX encoder unavailable, using PyTorch backend: {e}")
+        return False
+
+    # Only forward is replaced; input_size and prepare_input stay on the module
+    for name in list(model.encoder._modules):
+        setattr(model.encoder, name, None)
+
+    logger.info("Using ONNX Runtime for the Nougat encoder")
+    return True
@@ -10,6 +10,8 @@ from typing import Optional
 import click
 
 from paper2epub import Paper2EpubConverter, __version__
+from paper2epub.backends import BACKENDS
+from paper2epub.converter import QUANTIZE_MODES
 
 
 def setup_logging(verbose: bool = False):
@@ -62,14 +64,44 @@ def setup_logging(verbose: bool = False):
     "--device",
     type=click.Choice(["auto", "cuda", "mps", "cpu"]),
     default="auto",
-    help="Device to use (default: auto-detect)",
+    help="Device to use (default: $PAPER2EPUB_DEVICE or auto-detect)",
 )
 @click.option(
     "-b",
     "--batch-size",
     type=int,
-    default=1,
-    help="Batch size for processing (default: 1)",
+    default=None,
+    help="Batch size for processing (default: from GPU memory, 1 on CPU/MPS)",
+)
+@click.option(
+    "-j",
+    "--num-workers",
+    type=int,
+    default=0,
+    help="Worker processes for rasterization and figures (default: 0, main process)",
+)
+@click.option(
+    "--compile",
+    "compile_model",
+    is_flag=True,
+    help="Compile the Nougat encoder with torch.compile (CUDA only)",
+)
+@click.option(
+    "--backend",
+    type=click.Choice(BACKENDS),
+    default="torch",
+    help="Encoder inference backend (default: torch)",
+)
+@click.option(
+    "--quantize",
+    type=click.Choice(QUANTIZE_MODES),
+    default=None,
+    help="Quantize model weights (int8: CPU only)",
+)
+@click.option(
+    "--text-layer",
+    is_flag=True,
+    help="Use the PDF's embedded text instead of Nougat when it has no math",
 )
 @click.option(
     "--save-markdown",
@@ -102,7 +134,12 @@ def main(
     language: str,
     model: str,
     device: str,
-    batch_size: int,
+    batch_size: Optional[int],
+    num_workers: int,
+    compile_model: bool,
+    backend: str,
+    quantize: Optional[str],
+    text_layer: bool,
     save_markdown: bool,
     no_figures: bool,
     figure_min_size: int,
@@ -151,6 +188,11 @@ def main(
             model_tag=model_tag,
             device=device_arg,
             batch_size=batch_size,
+            num_workers=num_workers,
+            compile_model=compile_model,
+            backend=backend,
+            quantize=quantize,
+            text_layer=text_layer,
             extract_figures=not no_figures,
             figure_min_size=figure_min_size,
         )
@@ -37,6 +37,10 @@ MODEL_URLS = {
     "0.1.0-base": "facebook/nougat-base",
 }
 
+# MathJax bundle embedded into EPUBs (SVG output needs no external font files)
+MATHJAX_VERSION = "3.2.0"
+MATHJAX_URL = f"https://cdnjs.cloudflare.com/ajax/libs/mathjax/{MATHJAX_VERSION}/es5/tex-mml-svg.js"
+
 # Cache directory
 CACHE_DIR = Path.home() / ".cache" / "paper2epub"
 CACHE_DIR.mkdir(parents=True, exist_ok=True)
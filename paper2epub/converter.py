@@ -2,19 +2,517 @@
 Core converter module using Nougat for academic PDF processing
 """
 
+import functools
 import gc
+import hashlib
+import html
+import inspect
+import io
 import logging
+import os
+import queue
+import re
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import closing, nullcontext
 from pathlib import Path
-from typing import List, Optional, Tuple, Union
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
+import fitz  # PyMuPDF
+import markdown
 import torch
 from ebooklib import epub
+from PIL import Image
+from torch.torch_version import TorchVersion
+from torch.utils.data import DataLoader
 
+try:
+    import cmarkgfm
+    from cmarkgfm.cmark import Options as cmarkgfm_options
+except ImportError:  # optional, faster Markdown rendering
+    cmarkgfm = None
+
+try:
+    import latex2mathml.converter as latex2mathml
+except ImportError:  # optional, math pre-rendered to MathML
+    latex2mathml = None
+
+from paper2epub.backends import BACKENDS, TENSORRT_BATCH_SIZES, enable_onnx_encoder
+from paper2epub.config import MATHJAX_URL
 from paper2epub.figure_extractor import FigureExtractor, FigureMatcher
+from paper2epub.utils import format_file_size, get_device_info, load_mathjax
 
 logger = logging.getLogger(__name__)
 
 
+def _cuda_alloc_conf(torch_version: str) -> str:
+    """
+    CUDA caching allocator settings for the given PyTorch version.
+
+    Limits block splitting to reduce fragmentation across pages, and lets
+    segments grow in place where supported (PyTorch 2.0 rejects unknown options).
+    """
+    conf = "max_split_size_mb:128"
+    # TorchVersion compares release numbers, so "2.10" sorts after "2.1"
+    if TorchVersion(torch_version) >= (2, 1):
+        conf += ",expandable_segments:True"
+    return conf
+
+
+# Read by PyTorch on the first CUDA allocation, so setting it here is early enough
+_CUDA_ALLOC_CONF = _cuda_alloc_conf(torch.__version__)
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", _CUDA_ALLOC_CONF)
+
+# Supported weight quantization modes
+QUANTIZE_MODES = ["int8"]
+
+# Upper bound for the batch size picked from GPU memory
+_MAX_AUTO_BATCH_SIZE = 10
+
+# Page batches prepared ahead of inference on the DataLoader path
+_PREFETCH_BATCHES = 2
+
+# Rendered pages kept per converter (pages repeat across re-conversions and
+# within a document, e.g. running headers and figure sections)
+_HTML_CACHE_SIZE = 64
+
+# Average text-layer characters per page below which a PDF is treated as scanned
+_MIN_TEXT_CHARS_PER_PAGE = 500
+
+# Font names used for typeset math (Computer Modern, AMS, STIX, Cambria Math, ...)
+_MATH_FONT_PATTERN = re.compile(r"CMMI|CMSY|CMEX|MSAM|MSBM|Math", re.IGNORECASE)
+
+# Release cached CUDA blocks every N batches
+_EMPTY_CACHE_INTERVAL = 4
+
+# Threads running Nougat's markdown postprocessing alongside inference
+_POSTPROCESS_WORKERS = 4
+
+# LaTeX math kept out of cmarkgfm: $$...$$, \[...\] and \(...\). A single $ is
+# not a delimiter (nor in the MathJax config), so prices in prose stay text.
+_MATH_PATTERN = re.compile(r"\$\$.+?\$\$|\\\[.+?\\\]|\\\(.+?\\\)", re.DOTALL)
+# Fenced code blocks and code spans, matched ahead of math so their dollar
+# signs and backslashes are passed through to the renderer untouched. Math uses
+# the _MATH_PATTERN delimiters, so only those spans can request MathJax.
+_CODE_OR_MATH_PATTERN = re.compile(
+    r"(?P<code>^[ ]{0,3}(?P<fence>`{3,}|~{3,}).*?(?:^[ ]{0,3}(?P=fence)[ \t]*$|\Z)"
+    r"|(?P<ticks>`+)[^`].*?(?<!`)(?P=ticks)(?!`))|" + _MATH_PATTERN.pattern,
+    re.DOTALL | re.MULTILINE,
+)
+_MATH_PLACEHOLDER = "P2EMATH{}X"
+# Characters of text-layer paragraphs replaced by entities, so they never form math
+# delimiters or code spans
+_TEXT_LAYER_ESCAPES = str.maketrans({"\\": "&#92;", "$": "&#36;", "`": "&#96;"})
+_MATH_PLACEHOLDER_PATTERN = re.compile(r"P2EMATH(\d+)X")
+
+# EPUB media types by image file extension
+_MEDIA_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".svg": "image/svg+xml",
+}
+
+# Already-compressed image formats, stored in the EPUB without deflating
+_STORED_MEDIA_TYPES = {"image/png", "image/jpeg", "image/gif"}
+
+# Stylesheet shared by every generated EPUB
+_CSS_CONTENT = """
+body {
+    font-family: Georgia, serif;
+    line-height: 1.6;
+    margin: 2em;
+}
+h1, h2, h3, h4, h5, h6 {
+    font-family: Arial, sans-serif;
+    margin-top: 1.5em;
+    margin-bottom: 0.5em;
+}
+table {
+    border-collapse: collapse;
+    width: 100%;
+    margin: 1em 0;
+}
+th, td {
+    border: 1px solid #ddd;
+    padding: 8px;
+    text-align: left;
+}
+th {
+    background-color: #f2f2f2;
+}
+code {
+    background-color: #f4f4f4;
+    padding: 2px 5px;
+    border-radius: 3px;
+}
+pre {
+    background-color: #f4f4f4;
+    padding: 1em;
+    border-radius: 5px;
+    overflow-x: auto;
+}
+img {
+    max-width: 100%;
+    height: auto;
+}
+"""
+
+# Chapter document wrapping the rendered HTML
+_CHAPTER_TEMPLATE = """
+<html>
+<body>
+    {body}
+</body>
+</html>
+"""
+
+
+class _EpubWriter(epub.EpubWriter):
+    """EpubWriter that stores compressed images instead of deflating them again."""
+
+    def _write_items(self):
+        stored = {
+            f"{self.book.FOLDER_NAME}/{item.file_name}"
+            for item in self.book.get_items()
+            if item.media_type in _STORED_MEDIA_TYPES
+        }
+        writestr = self.out.writestr
+
+        def _writestr(name, data, compress_type=None, **kwargs):
+            if name in stored:
+                compress_type = zipfile.ZIP_STORED
+            writestr(name, data, compress_type=compress_type, **kwargs)
+
+        self.out.writestr = _writestr
+        try:
+            super()._write_items()
+        finally:
+            del self.out.writestr
+
+
+def _compile_encoder(model) -> None:
+    """Compile the Nougat vision encoder forward pass with torch.compile."""
+    # Only the encoder sees fixed input shapes. The decoder runs under
+    # generate() with a KV cache that grows every step, so compiling it
+    # would recompile per sequence length (no static cache on transformers<4.35)
+    model.encoder.forward = torch.compile(model.encoder.forward, mode="reduce-overhead")
+    logger.info("Compiled Nougat encoder with torch.compile")
+
+
+def _reduce_step_scores(scores: torch.Tensor, special_ids: Tuple[int, ...]) -> torch.Tensor:
+    """
+    Shrink one decoder step's [B, V] scores to the part Nougat's repetition check reads.
+
+    Nougat only uses the max score per step and whether the argmax is the pad or
+    EOS token. The result keeps the max in column ``token_id`` for those tokens
+    and in the last column otherwise, with every other entry -inf, so its max
+    values and special-token indices match the full scores.
+    """
+    width = max(special_ids) + 2
+    values, indices = scores.max(-1)
+    columns = torch.full_like(indices, width - 1)
+    for token_id in special_ids:
+        columns = torch.where(indices == token_id, indices, columns)
+    reduced = scores.new_full((scores.shape[0], width), float("-inf"))
+    return reduced.scatter_(1, columns.unsqueeze(1), values.unsqueeze(1))
+
+
+def _reduce_scores_on_device(model) -> None:
+    """
+    Reduce the decoder's per-step scores on the device before Nougat copies them.
+
+    NougatModel.inference runs ``torch.stack(scores, 1).cpu().max(-1)``, which
+    moves the full B x T x V float tensor to the host for its repetition check.
+    generate() is wrapped so each step is reduced to a few columns first.
+    """
+    generate = model.decoder.model.generate
+
+    def generate_with_reduced_scores(*args, **kwargs):
+        output = generate(*args, **kwargs)
+        if output.scores:
+            tokenizer = model.decoder.tokenizer
+            special_ids = (tokenizer.pad_token_id, tokenizer.eos_token_id)
+            output.scores = tuple(_reduce_step_scores(s, special_ids) for s in output.scores)
+        return output
+
+    model.decoder.model.generate = generate_with_reduced_scores
+
+
+def _quantize_int8(model):
+    """Quantize the model's Linear layers to int8 with dynamic activation scales."""
+    from torch.ao.quantization import quantize_dynamic
+
+    # Activation scales are computed per batch at runtime, so no calibration pages are needed
+    model = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    logger.info("Quantized Nougat Linear layers to int8")
+    return model
+
+
+def _warmup(model, device: str, dtype: torch.dtype, batch_size: int):
+    """
+    Run one dummy batch so cuDNN autotuning (and torch.compile, if enabled)
+    happens before the first PDF.
+    """
+    # Page tensors always have the encoder input size, so autotuned kernels are reused
+    torch.backends.cudnn.benchmark = True
+
+    # Kernels are tuned (and CUDA graphs captured) per shape, so use the real batch size
+    dummy = torch.zeros(
+        batch_size,
+        3,
+        *model.encoder.input_size,
+        device=device,
+        dtype=dtype,
+    )
+    try:
+        with torch.inference_mode(), torch.autocast(device_type=device, dtype=dtype):
+            model.inference(image_tensors=dummy, return_attentions=False)
+    except torch.cuda.OutOfMemoryError:
+        # Inference splits batches on OOM itself, so the first PDF still runs
+        logger.warning("Out of memory while warming up the Nougat model, skipping warm-up")
+        torch.cuda.empty_cache()
+        return
+    logger.debug("Warmed up Nougat model")
+
+
+@functools.lru_cache(maxsize=4)
+def _get_model(
+    model_tag: str,
+    device: str,
+    backend: str,
+    compile_model: bool,
+    quantize: Optional[str] = None,
+    warmup_batch_size: Optional[int] = None,
+) -> Tuple[Any, torch.dtype]:
+    """
+    Load a Nougat model, shared by every converter with the same settings.
+
+    On CUDA the model is warmed up once here, so cached models are not re-run.
+
+    Args:
+        model_tag: Nougat model version
+        device: Device to load the model on
+        backend: Encoder inference backend
+        compile_model: Compile the vision encoder with torch.compile (CUDA only)
+        quantize: Weight quantization mode ('int8', CPU only), or None
+        warmup_batch_size: Page batch size of the CUDA warm-up run, or None to skip it
+
+    Returns:
+        Tuple of (model in eval mode, model dtype)
+    """
+    from nougat import NougatModel
+    from nougat.utils.checkpoint import get_checkpoint
+
+    checkpoint = get_checkpoint(None, model_tag=model_tag)
+    model = NougatModel.from_pretrained(checkpoint)
+    model = model.to(device)
+
+    # Export/load the ONNX encoder while weights are still fp32
+    if backend in ("onnx", "tensorrt"):
+        enable_onnx_encoder(model, model_tag, device, tensorrt=backend == "tensorrt")
+
+    # Half precision on CUDA: bf16 where supported, fp16 otherwise.
+    # CPU/MPS stay in fp32.
+    dtype = torch.float32
+    if device == "cuda":
+        dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        model = model.to(dtype)
+        if backend == "torch":
+            # NHWC lets cuDNN pick its faster kernels for the patch-embedding conv
+            model.encoder.to(memory_format=torch.channels_last)
+
+    model.eval()
+    if quantize == "int8":
+        # Dynamic int8 kernels are CPU-only; CUDA already runs in bf16/fp16
+        if device == "cpu":
+            model = _quantize_int8(model)
+        else:
+            logger.warning(f"int8 quantization is only used on CPU, skipping on {device}")
+
+    if compile_model:
+        if device == "cuda":
+            _compile_encoder(model)
+        else:
+            logger.warning(f"torch.compile is only used on CUDA, skipping on {device}")
+
+    _reduce_scores_on_device(model)
+
+    if device == "cuda" and warmup_batch_size:
+        _warmup(model, device, dtype, warmup_batch_size)
+
+    return model, dtype
+
+
+def release_models() -> None:
+    """
+    Drop every cached Nougat model and free the GPU memory they held.
+
+    Models are shared by converters with the same settings and outlive
+    ``Paper2EpubConverter.close()``; call this once no converter needs them.
+    """
+    _get_model.cache_clear()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    gc.collect()
+
+
+def _math_to_mathml(math: str) -> Optional[str]:
+    """
+    Render one delimited LaTeX span to MathML.
+
+    Returns None when latex2mathml is not installed or does not understand
+    the expression, so the LaTeX is left for MathJax.
+    """
+    if latex2mathml is not None:
+        # $$...$$, \[...\] and \(...\) all have two-character delimiters
+        display = "block" if math.startswith(("$$", "\\[")) else "inline"
+        try:
+            mathml = latex2mathml.convert(math[2:-2].strip(), display=display)
+            # Unknown commands are passed through verbatim rather than raising
+            if "\\" not in mathml:
+                return mathml
+        except Exception as e:
+            logger.debug(f"MathML conversion failed, leaving math for MathJax: {e}")
+    return None
+
+
+def _collate_pages(
+    batch: List[Tuple[Optional[torch.Tensor], str]],
+) -> Tuple[Optional[torch.Tensor], List[bool]]:
+    """
+    Stack rendered page tensors from LazyDataset into a single batch.
+
+    Returns:
+        Tuple of (stacked tensor or None if no page rendered,
+        per-page flags telling which pages rendered successfully)
+    """
+    rendered = [image is not None for image, _ in batch]
+    images = [image for image, _ in batch if image is not None]
+    if not images:
+        return None, rendered
+    return torch.stack(images), rendered
+
+
+def _prefetch(iterable: Iterable, depth: int) -> Iterator:
+    """
+    Iterate in a background thread, keeping up to `depth` items ready.
+
+    Exceptions raised by the iterable are re-raised in the consumer.
+    """
+    items: queue.Queue = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+    errors: List[Exception] = []
+
+    def put(item) -> bool:
+        # Give up once the consumer has gone away instead of blocking forever
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            # Run a generator's cleanup here, also when the consumer stopped early
+            if inspect.isgenerator(iterable):
+                iterable.close()
+            put(done)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                break
+            yield item
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
+        producer.join()
+
+
+def _postprocessed(future: Future) -> Optional[str]:
+    """Return the markdown from a postprocessing future, or None if it failed."""
+    try:
+        return future.result()
+    except Exception as e:
+        logger.error(f"Failed to postprocess page: {e}")
+        return None
+
+
+def _text_layer_pages(pdf_path: Path) -> Optional[List[str]]:
+    """
+    Read per-page Markdown from the PDF's embedded text layer.
+
+    Paragraphs are emitted as escaped HTML blocks, so PDF text that looks like
+    Markdown or math ("# 1", "* note", "$$x$$") is shown literally.
+
+    Returns:
+        One Markdown string per page, or None if the PDF looks scanned or
+        contains typeset math and needs Nougat
+    """
+    with fitz.open(str(pdf_path)) as doc:
+        if len(doc) == 0:
+            return None
+
+        pages: List[str] = []
+        num_chars = 0
+        for page in doc:
+            for font in page.get_fonts():
+                # Type3 fonts are common for rasterized glyphs and math symbols
+                if font[2] == "Type3" or _MATH_FONT_PATTERN.search(font[3]):
+                    logger.info(f"Math font {font[3]} on page {page.number + 1}, using Nougat")
+                    return None
+
+            paragraphs = []
+            for block in page.get_text("blocks", sort=True):
+                # Block tuples end with the block type: 0 for text, 1 for images
+                if block[6] == 0:
+                    text = " ".join(block[4].split())
+                    if text:
+                        # Entities for the characters math and code protection look for
+                        escaped = html.escape(text, quote=False).translate(_TEXT_LAYER_ESCAPES)
+                        paragraphs.append(f"<p>{escaped}</p>")
+                        num_chars += len(text)
+            pages.append("\n\n".join(paragraphs))
+
+        if num_chars / len(doc) < _MIN_TEXT_CHARS_PER_PAGE:
+            logger.info("Too little embedded text, using Nougat")
+            return None
+
+    return pages
+
+
+def _rasterize_page(pdf_path: str, page_idx: int) -> Optional[bytes]:
+    """
+    Rasterize a single PDF page in a worker process.
+
+    Returns:
+        Encoded page image bytes, or None if rendering failed
+    """
+    from nougat.dataset.rasterize import rasterize_paper
+
+    pages = rasterize_paper(pdf_path, pages=[page_idx])
+    if not pages:
+        return None
+    return pages[0].getvalue()
+
+
 class Paper2EpubConverter:
     """
     Main converter class for transforming academic PDFs to EPUB format.
@@ -25,24 +523,54 @@ class Paper2EpubConverter:
         self,
         model_tag: str = "0.1.0-small",
         device: Optional[str] = None,
-        batch_size: int = 1,
+        batch_size: Optional[int] = None,
         extract_figures: bool = True,
         figure_min_size: int = 100,
+        num_workers: int = 0,
+        compile_model: bool = False,
+        backend: str = "torch",
+        quantize: Optional[str] = None,
+        text_layer: bool = False,
     ):
         """
         Initialize the converter.
 
         Args:
             model_tag: Nougat model version ('0.1.0-small', '0.1.0-base')
-            device: Device to run on ('cuda', 'mps', 'cpu', or None for auto-detect)
-            batch_size: Batch size for processing pages
+            device: Device to run on ('cuda', 'mps', 'cpu', or None to use the
+                PAPER2EPUB_DEVICE environment variable or auto-detect)
+            batch_size: Batch size for processing pages (None picks one from GPU
+                memory on CUDA, 1 on CPU/MPS)
             extract_figures: Whether to extract figures from PDF
             figure_min_size: Minimum figure size in pixels to extract
+            num_workers: Worker processes for page rasterization and figure
+                extraction (0 keeps both in the main process)
+            compile_model: Compile the vision encoder with torch.compile (CUDA only)
+            backend: Encoder inference backend ('torch', 'onnx' or 'tensorrt')
+            quantize: Quantize model weights ('int8', CPU only), or None
+            text_layer: Use the PDF's embedded text instead of Nougat when it
+                has enough text and no typeset math
         """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+        if quantize is not None and quantize not in QUANTIZE_MODES:
+            raise ValueError(f"Unknown quantization '{quantize}', expected one of {QUANTIZE_MODES}")
+
         self.model_tag = model_tag
         self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.compile_model = compile_model
+        self.backend = backend
+        self.quantize = quantize
+        self.text_layer = text_layer
         self.extract_figures = extract_figures
 
+        # Explicit argument wins, then PAPER2EPUB_DEVICE, then auto-detection
+        if device is None:
+            device = os.environ.get("PAPER2EPUB_DEVICE") or None
+        if device == "auto":
+            device = None
+
         # Auto-detect device if not specified
         if device is None:
             if torch.cuda.is_available():
@@ -54,6 +582,20 @@ class Paper2EpubConverter:
         else:
             self.device = device
 
+        if self.device == "cuda":
+            self._check_cuda()
+
+        if self.batch_size is None:
+            self.batch_size = self._default_batch_size()
+
+        # The TensorRT engine profile has a fixed maximum batch size
+        max_batch = TENSORRT_BATCH_SIZES[-1]
+        if self.backend == "tensorrt" and self.batch_size > max_batch:
+            logger.warning(
+                f"Batch size {self.batch_size} exceeds the TensorRT engine, using {max_batch}"
+            )
+            self.batch_size = max_batch
+
         # Initialize figure extraction components
         self.figure_extractor = None
         self.figure_matcher = None
@@ -61,15 +603,59 @@ class Paper2EpubConverter:
             self.figure_extractor = FigureExtractor(
                 min_width=figure_min_size,
                 min_height=figure_min_size,
+                num_workers=num_workers,
             )
             self.figure_matcher = FigureMatcher()
 
         # Lazy model loading
         self._model = None
         self._model_loaded = False
+        self._dtype = torch.float32
+        self._copy_stream = None
+
+        # Markdown parser is built once and reset between documents
+        self._md = markdown.Markdown(
+            extensions=[
+                "extra",
+                "codehilite",
+                "fenced_code",
+                "tables",
+                "nl2br",
+            ]
+        )
+        # Rendered HTML per page, so re-converting a document (or repeated
+        # pages within one) skips the Markdown pass. The cache holds a bound
+        # method, so close() clears it to drop the pages and the cycle.
+        self._render_html = functools.lru_cache(maxsize=_HTML_CACHE_SIZE)(self._markdown_to_html)
 
         logger.info(f"Initializing Paper2Epub converter with device: {self.device}")
 
+    def _check_cuda(self):
+        """Fail early if CUDA was requested but no GPU is visible."""
+        if torch.cuda.device_count() == 0:
+            message = "CUDA device requested but no GPU is available"
+            visible = os.environ.get("CUDA_VISIBLE_DEVICES")
+            if visible is not None:
+                message += f" (CUDA_VISIBLE_DEVICES={visible!r})"
+            logger.error(message)
+            raise RuntimeError(message)
+
+        info = get_device_info()
+        logger.info(
+            f"Using GPU: {info['cuda_device_name']} "
+            f"({format_file_size(info['cuda_memory_free'])} free of "
+            f"{format_file_size(info['cuda_memory_total'])})"
+        )
+
+    def _default_batch_size(self) -> int:
+        """Pick a page batch size from total GPU memory (1 on CPU/MPS)."""
+        if self.device != "cuda" or not torch.cuda.is_available():
+            return 1
+
+        # Nougat's own heuristic of ~0.3 pages per GB, capped where throughput plateaus
+        total_gb = torch.cuda.get_device_properties(0).total_memory / 1024**3
+        return max(1, min(_MAX_AUTO_BATCH_SIZE, int(total_gb * 0.3)))
+
     @property
     def model(self):
         """Lazy load model on first access."""
@@ -80,13 +666,15 @@ class Paper2EpubConverter:
     def _load_model(self):
         """Load Nougat model lazily."""
         try:
-            from nougat import NougatModel
-            from nougat.utils.checkpoint import get_checkpoint
-
-            checkpoint = get_checkpoint(None, model_tag=self.model_tag)
-            self._model = NougatModel.from_pretrained(checkpoint)
-            self._model = self._model.to(self.device)
-            self._model.eval()
+            self._model, self._dtype = _get_model(
+                self.model_tag,
+                self.device,
+                self.backend,
+                self.compile_model and self.backend == "torch",
+                self.quantize,
+                # Only CUDA warms up, so other devices share a model across batch sizes
+                self.batch_size if self.device == "cuda" else None,
+            )
             self._model_loaded = True
             logger.info(f"Nougat model '{self.model_tag}' loaded successfully")
         except ImportError as e:
@@ -108,6 +696,146 @@ class Paper2EpubConverter:
 
         gc.collect()
 
+    def close(self):
+        """
+        Release this converter's model reference, copy stream and rendered pages.
+
+        The model itself stays in the shared cache for other converters with the
+        same settings; use release_models() to free it.
+        """
+        self._render_html.cache_clear()
+        self._copy_stream = None
+        self._cleanup_memory()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _to_device(self, image_tensors: torch.Tensor) -> torch.Tensor:
+        """
+        Move a page batch to the inference device.
+
+        On CUDA the batch is copied from pinned memory on a dedicated stream
+        so the host-to-device transfer overlaps with compute.
+        """
+        if self.device != "cuda":
+            return image_tensors.to(self.device)
+
+        if not image_tensors.is_pinned():
+            image_tensors = image_tensors.pin_memory()
+        if self._copy_stream is None:
+            self._copy_stream = torch.cuda.Stream()
+
+        # Match the encoder's channels-last weights (ONNX Runtime wants NCHW)
+        memory_format = torch.channels_last if self.backend == "torch" else torch.contiguous_format
+        with torch.cuda.stream(self._copy_stream):
+            image_tensors = image_tensors.to(
+                self.device, non_blocking=True, memory_format=memory_format
+            )
+
+        # Make the compute stream wait for the copy before the forward pass
+        compute_stream = torch.cuda.current_stream()
+        compute_stream.wait_stream(self._copy_stream)
+        image_tensors.record_stream(compute_stream)
+        return image_tensors
+
+    def _autocast(self):
+        """Autocast context for inference (reduced precision on CUDA only)."""
+        if self.device == "cuda":
+            return torch.autocast(device_type="cuda", dtype=self._dtype)
+        return nullcontext()
+
+    def _run_inference(self, image_tensors: torch.Tensor) -> List[str]:
+        """
+        Run Nougat on a batch of page tensors.
+
+        On CUDA out-of-memory errors the batch is split in half and retried,
+        and the reduced batch size is kept for subsequent batches.
+
+        Args:
+            image_tensors: Batch of prepared page tensors [B, C, H, W]
+
+        Returns:
+            Raw Nougat predictions, one per page
+        """
+        try:
+            # Entered once per batch rather than around the page loop: that loop
+            # is a generator, and grad mode is thread-local, so holding it across
+            # yields would leak inference mode into the caller's code.
+            # Token IDs are chosen on-device by generate(). Nougat copies the
+            # per-step scores to the host for its repetition check, so
+            # _reduce_scores_on_device shrinks them to a few columns per step first.
+            with torch.inference_mode(), self._autocast():
+                outputs = self.model.inference(
+                    image_tensors=image_tensors,
+                    return_attentions=False,
+                )
+        except torch.cuda.OutOfMemoryError:
+            if len(image_tensors) <= 1:
+                raise
+            self.batch_size = max(1, len(image_tensors) // 2)
+            logger.warning(f"CUDA out of memory, retrying with batch size {self.batch_size}")
+            torch.cuda.empty_cache()
+
+            predictions: List[str] = []
+            for chunk in image_tensors.split(self.batch_size):
+                predictions.extend(self._run_inference(chunk))
+            return predictions
+
+        return outputs.get("predictions", [])
+
+    def _iter_rasterized_batches(
+        self,
+        pdf_path: Path,
+        num_pages: int,
+        prepare: Callable[[Image.Image], torch.Tensor],
+    ) -> Iterator[Tuple[Optional[torch.Tensor], List[bool]]]:
+        """
+        Yield page batches rasterized by a pool of worker processes.
+
+        Pages are rendered in parallel while a background thread prepares
+        them for the encoder, so rasterization overlaps with inference.
+
+        Args:
+            pdf_path: Path to input PDF file
+            num_pages: Number of pages in the PDF
+            prepare: Encoder input preparation function
+
+        Yields:
+            Batches in the same format as the DataLoader path
+        """
+
+        def rasterized_pages():
+            pool = ProcessPoolExecutor(max_workers=self.num_workers)
+            try:
+                futures = [
+                    pool.submit(_rasterize_page, str(pdf_path), idx) for idx in range(num_pages)
+                ]
+                # Consume in submission order to keep pages ordered
+                for idx, future in enumerate(futures):
+                    try:
+                        image_bytes = future.result()
+                        image = prepare(Image.open(io.BytesIO(image_bytes)))
+                    except Exception as e:
+                        logger.debug(f"Failed to rasterize page {idx + 1}: {e}")
+                        image = None
+                    yield image, ""
+            finally:
+                # Drop pages not rendered yet when the consumer stops early
+                pool.shutdown(wait=True, cancel_futures=True)
+
+        batch = []
+        with closing(_prefetch(rasterized_pages(), 2 * self.batch_size)) as pages:
+            for item in pages:
+                batch.append(item)
+                if len(batch) == self.batch_size:
+                    yield _collate_pages(batch)
+                    batch = []
+        if batch:
+            yield _collate_pages(batch)
+
     def extract_pdf_to_markdown(self, pdf_path: Union[str, Path]) -> str:
         """
         Extract PDF content to Markdown using Nougat.
@@ -118,6 +846,20 @@ class Paper2EpubConverter:
         Returns:
             Extracted markdown content with LaTeX equations
         """
+        return "\n\n".join(self.iter_page_markdown(pdf_path))
+
+    def iter_page_markdown(self, pdf_path: Union[str, Path]) -> Iterator[str]:
+        """
+        Extract PDF content page by page using Nougat.
+
+        Args:
+            pdf_path: Path to input PDF file
+
+        Yields:
+            Markdown content with LaTeX equations, one string per page
+        """
+        # Imported here rather than at module level: nougat pulls in
+        # transformers, which would slow down every import of paper2epub
         from nougat.utils.dataset import LazyDataset
         from nougat.postprocessing import markdown_compatible
 
@@ -134,58 +876,137 @@ class Paper2EpubConverter:
                 str(pdf_path),
                 prepare=self.model.encoder.prepare_input,
             )
+            num_pages = len(dataset)
 
-            # Process PDF page by page
-            markdown_content = []
+            if self.num_workers > 0:
+                batches = self._iter_rasterized_batches(pdf_path, num_pages, dataset.prepare)
+            else:
+                # Stack pages into [B, C, H, W] batches so each inference call
+                # processes up to batch_size pages at once
+                loader = DataLoader(
+                    dataset,
+                    batch_size=self.batch_size,
+                    shuffle=False,
+                    collate_fn=_collate_pages,
+                    pin_memory=self.device == "cuda",
+                )
+                # Prepare and pin the next batches on a thread while the
+                # current one runs on the device
+                batches = _prefetch(loader, _PREFETCH_BATCHES)
+
+            num_extracted = 0
+            page_idx = 0
+
+            # Postprocessing futures in page order
+            pending: Deque[Future] = deque()
+
+            # Closing the batches stops background rasterization if the caller
+            # abandons this generator early
+            with (
+                closing(batches),
+                ThreadPoolExecutor(max_workers=_POSTPROCESS_WORKERS) as post_pool,
+            ):
+                for batch_idx, (image_tensors, rendered) in enumerate(batches, 1):
+                    first_page = page_idx + 1
+                    page_idx += len(rendered)
 
-            # Process each page individually to avoid batching issues
-            for idx in range(len(dataset)):
-                try:
-                    image_tensor, _ = dataset[idx]
+                    for offset, ok in enumerate(rendered):
+                        if not ok:
+                            logger.warning(
+                                f"Skipping page {first_page + offset} (failed to render)"
+                            )
 
-                    if image_tensor is None:
-                        logger.warning(f"Skipping page {idx + 1} (failed to render)")
+                    if image_tensors is None:
                         continue
 
-                    # image_tensor is already prepared by encoder.prepare_input
-                    # Add batch dimension if needed
-                    if image_tensor.dim() == 3:
-                        image_tensor = image_tensor.unsqueeze(0)
+                    try:
+                        predictions = self._run_inference(self._to_device(image_tensors))
 
-                    with torch.no_grad():
-                        outputs = self.model.inference(
-                            image_tensors=image_tensor,
-                            return_attentions=False,
-                        )
+                        # Postprocess on worker threads while the next batch runs
+                        for pred in predictions:
+                            if pred:
+                                pending.append(post_pool.submit(markdown_compatible, pred))
 
-                    # Extract predictions from output
-                    for pred in outputs.get("predictions", []):
-                        if pred:
-                            markdown = markdown_compatible(pred)
-                            markdown_content.append(markdown)
+                        logger.info(f"Processed pages {first_page}-{page_idx}/{num_pages}")
 
-                    logger.info(f"Processed page {idx + 1}/{len(dataset)}")
+                    except Exception as e:
+                        logger.error(f"Failed to process pages {first_page}-{page_idx}: {e}")
+                        logger.debug("Inference traceback", exc_info=True)
 
-                except Exception as e:
-                    logger.error(f"Failed to process page {idx + 1}: {e}")
-                    import traceback
+                    # Drop batch references so the allocator can reuse the memory
+                    del image_tensors
+                    if self.device == "cuda" and batch_idx % _EMPTY_CACHE_INTERVAL == 0:
+                        torch.cuda.empty_cache()
 
-                    logger.debug(traceback.format_exc())
-                    continue
+                    # Emit pages whose postprocessing already finished
+                    while pending and pending[0].done():
+                        markdown = _postprocessed(pending.popleft())
+                        if markdown is not None:
+                            num_extracted += 1
+                            yield markdown
 
-            if not markdown_content:
-                raise ValueError("No content extracted from PDF")
+                while pending:
+                    markdown = _postprocessed(pending.popleft())
+                    if markdown is not None:
+                        num_extracted += 1
+                        yield markdown
 
-            full_markdown = "\n\n".join(markdown_content)
-            return full_markdown
+            # Keep the model loaded for the next document, only drop cached blocks
+            if self.device == "cuda":
+                torch.cuda.empty_cache()
+
+            if not num_extracted:
+                raise ValueError("No content extracted from PDF")
 
         except Exception as e:
             logger.error(f"Failed to extract PDF: {e}")
             raise
 
+    def _markdown_to_html(self, text: str) -> Tuple[str, bool]:
+        """
+        Render markdown to HTML.
+
+        LaTeX math outside code is shielded from Markdown processing and
+        rendered to MathML where possible. Uses the C-backed cmarkgfm renderer
+        when installed and python-markdown otherwise.
+
+        Returns:
+            Tuple of (HTML, whether any math was left as LaTeX for MathJax)
+        """
+        math: List[str] = []
+
+        def protect(match: "re.Match[str]") -> str:
+            if match.group("code"):
+                return match.group(0)
+            math.append(match.group(0))
+            return _MATH_PLACEHOLDER.format(len(math) - 1)
+
+        protected = _CODE_OR_MATH_PATTERN.sub(protect, text)
+        if cmarkgfm is None:
+            html_content = self._md.reset().convert(protected)
+        else:
+            html_content = cmarkgfm.markdown_to_html_with_extensions(
+                protected,
+                options=cmarkgfm_options.CMARK_OPT_UNSAFE | cmarkgfm_options.CMARK_OPT_HARDBREAKS,
+                extensions=["table", "autolink", "strikethrough"],
+            )
+
+        needs_mathjax = False
+
+        def restore(match: "re.Match[str]") -> str:
+            nonlocal needs_mathjax
+            tex = math[int(match.group(1))]
+            mathml = _math_to_mathml(tex)
+            if mathml is None:
+                needs_mathjax = True
+                return html.escape(tex, quote=False)
+            return mathml
+
+        return _MATH_PLACEHOLDER_PATTERN.sub(restore, html_content), needs_mathjax
+
     def markdown_to_epub(
         self,
-        markdown_content: str,
+        markdown_content: Union[str, Iterable[str]],
         output_path: Union[str, Path],
         title: str = "Academic Paper",
         author: str = "Unknown",
@@ -196,15 +1017,14 @@ class Paper2EpubConverter:
         Convert markdown content to EPUB format.
 
         Args:
-            markdown_content: Markdown content with LaTeX equations
+            markdown_content: Markdown content with LaTeX equations, either as
+                a single string or as an iterable of per-page strings
             output_path: Path for output EPUB file
             title: Book title
             author: Author name
             language: Language code
             images: Optional list of (filename, bytes) tuples for embedded images
         """
-        import markdown
-
         output_path = Path(output_path)
         logger.info(f"Creating EPUB: {output_path.name}")
 
@@ -215,114 +1035,90 @@ class Paper2EpubConverter:
         book.set_language(language)
         book.add_author(author)
 
-        # Convert markdown to HTML
-        md = markdown.Markdown(
-            extensions=[
-                "extra",
-                "codehilite",
-                "fenced_code",
-                "tables",
-                "nl2br",
-            ]
-        )
-        html_content = md.convert(markdown_content)
+        # Convert markdown to HTML page by page. Only pages are cached; a whole
+        # document passed as one string is rendered directly.
+        render = self._render_html
+        if isinstance(markdown_content, str):
+            markdown_content = [markdown_content]
+            render = self._markdown_to_html
+        html_pages = []
+        needs_mathjax = False
+        for page in markdown_content:
+            page_html, page_needs_mathjax = render(page)
+            html_pages.append(page_html)
+            needs_mathjax = needs_mathjax or page_needs_mathjax
+        html_content = "\n".join(html_pages)
 
-        # Add MathJax/KaTeX support for LaTeX equations
-        mathjax_script = """
-        <script type="text/javascript" async
-          src="https://cdnjs.cloudflare.com/ajax/libs/mathjax/3.2.0/es5/tex-mml-chtml.js">
-        </script>
-        """
-
-        # Create CSS
-        css_content = """
-        body {
-            font-family: Georgia, serif;
-            line-height: 1.6;
-            margin: 2em;
-        }
-        h1, h2, h3, h4, h5, h6 {
-            font-family: Arial, sans-serif;
-            margin-top: 1.5em;
-            margin-bottom: 0.5em;
-        }
-        table {
-            border-collapse: collapse;
-            width: 100%;
-            margin: 1em 0;
-        }
-        th, td {
-            border: 1px solid #ddd;
-            padding: 8px;
-            text-align: left;
-        }
-        th {
-            background-color: #f2f2f2;
-        }
-        code {
-            background-color: #f4f4f4;
-            padding: 2px 5px;
-            border-radius: 3px;
-        }
-        pre {
-            background-color: #f4f4f4;
-            padding: 1em;
-            border-radius: 5px;
-            overflow-x: auto;
-        }
-        img {
-            max-width: 100%;
-            height: auto;
-        }
-        """
+        # Math that is still LaTeX (not pre-rendered to MathML) needs MathJax,
+        # bundled into the EPUB so readers can render it offline
+        mathjax_src = None
+        if needs_mathjax:
+            mathjax_bytes = load_mathjax()
+            if mathjax_bytes is not None:
+                book.add_item(
+                    epub.EpubItem(
+                        uid="mathjax",
+                        file_name="js/mathjax.js",
+                        media_type="application/javascript",
+                        content=mathjax_bytes,
+                    )
+                )
+                mathjax_src = "js/mathjax.js"
+            else:
+                mathjax_src = MATHJAX_URL
 
         # Add CSS
         nav_css = epub.EpubItem(
             uid="style_nav",
             file_name="style/nav.css",
             media_type="text/css",
-            content=css_content,
+            content=_CSS_CONTENT,
         )
         book.add_item(nav_css)
 
-        # Create chapter
-        chapter = epub.EpubHtml(
-            title=title,
-            file_name="content.xhtml",
-            lang=language,
-        )
-        chapter.content = f"""
-        <html>
-        <head>
-            <link rel="stylesheet" href="style/nav.css" type="text/css"/>
-            {mathjax_script}
-        </head>
-        <body>
-            {html_content}
-        </body>
-        </html>
-        """
-        book.add_item(chapter)
-
-        # Add images to EPUB
+        # Add images to EPUB, storing identical payloads (repeated logos, icons) once
         if images:
+            canonical: Dict[bytes, str] = {}
             for filename, image_bytes in images:
-                # Determine media type
-                if filename.lower().endswith(".png"):
-                    media_type = "image/png"
-                elif filename.lower().endswith((".jpg", ".jpeg")):
-                    media_type = "image/jpeg"
-                else:
-                    media_type = "image/png"  # Default to PNG
+                digest = hashlib.blake2b(image_bytes, digest_size=16).digest()
+                if digest in canonical:
+                    html_content = html_content.replace(
+                        f'"images/{filename}"', f'"images/{canonical[digest]}"'
+                    )
+                    continue
+                canonical[digest] = filename
+
+                # Default to PNG for unknown extensions
+                media_type = _MEDIA_TYPES.get(Path(filename).suffix.lower(), "image/png")
 
+                # Hashed uid stays a valid XML id whatever the filename contains
                 image_item = epub.EpubItem(
-                    uid=f"image_{filename.replace('.', '_')}",
+                    uid=f"image_{hashlib.md5(filename.encode()).hexdigest()[:8]}",
                     file_name=f"images/{filename}",
                     media_type=media_type,
                     content=image_bytes,
                 )
                 book.add_item(image_item)
-            logger.info(f"Added {len(images)} images to EPUB")
+            logger.info(
+                f"Added {len(canonical)} images to EPUB "
+                f"({len(images) - len(canonical)} duplicates skipped)"
+            )
+
+        # Create chapter
+        chapter = epub.EpubHtml(
+            title=title,
+            file_name="content.xhtml",
+            lang=language,
+        )
+        # ebooklib rebuilds <head> from the chapter links, so register the
+        # stylesheet and script there rather than in the content
+        chapter.add_link(href="style/nav.css", rel="stylesheet", type="text/css")
+        if mathjax_src is not None:
+            chapter.add_link(src=mathjax_src, type="text/javascript")
+        if "<math" in html_content:
+            chapter.properties.append("mathml")
+        chapter.content = _CHAPTER_TEMPLATE.format(body=html_content)
+        book.add_item(chapter)
 
         # Create table of contents
         book.toc = (chapter,)
@@ -334,9 +1130,65 @@ class Paper2EpubConverter:
 
         # Write EPUB file
         output_path.parent.mkdir(parents=True, exist_ok=True)
-        epub.write_epub(str(output_path), book)
+        writer = _EpubWriter(str(output_path), book)
+        writer.process()
+        writer.write()
         logger.info(f"EPUB created successfully: {output_path}")
 
+    def extract_document(
+        self,
+        pdf_path: Union[str, Path],
+        figures: Optional[List[Dict[str, Any]]] = None,
+    ) -> Tuple[List[str], List[Tuple[str, bytes]]]:
+        """
+        Extract per-page Markdown and figures from a PDF without writing the EPUB.
+
+        Args:
+            pdf_path: Path to input PDF file
+            figures: Figures already extracted with FigureExtractor.extract_images,
+                e.g. prefetched while the previous PDF was inferred (extracted from
+                the PDF if None; an empty list skips extraction)
+
+        Returns:
+            Tuple of (Markdown pages, list of (filename, image_data) tuples)
+        """
+        pdf_path = Path(pdf_path)
+
+        # Step 1: Extract PDF to per-page Markdown. PyMuPDF is not thread-safe, so the
+        # text layer is probed before figure extraction starts on the pool thread.
+        pages = _text_layer_pages(pdf_path) if self.text_layer else None
+        figures_future = None
+        if pages is not None:
+            logger.info(f"Using the embedded text layer of {pdf_path.name}, skipping Nougat")
+        else:
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                # Figures are read from the PDF's embedded image streams rather than
+                # the rasterized pages, so extract them while Nougat runs
+                if self.extract_figures and figures is None:
+                    figures_future = pool.submit(self.figure_extractor.extract_images, pdf_path)
+                pages = list(self.iter_page_markdown(pdf_path))
+
+        # Step 2: Integrate figures
+        images: List[Tuple[str, bytes]] = []
+        if self.extract_figures:
+            try:
+                extracted_images = figures
+                if figures_future is not None:
+                    extracted_images = figures_future.result()
+                elif extracted_images is None:
+                    extracted_images = self.figure_extractor.extract_images(pdf_path)
+                if extracted_images:
+                    # The matcher appends a Figures section, so it becomes the last page
+                    figures_markdown, images = self.figure_matcher.insert_images_into_markdown(
+                        "", extracted_images
+                    )
+                    pages.append(figures_markdown.strip())
+                    logger.info(f"Integrated {len(images)} figures into document")
+            except Exception as e:
+                logger.warning(f"Figure extraction failed, continuing without figures: {e}")
+
+        return pages, images
+
     def convert(
         self,
         pdf_path: Union[str, Path],
@@ -345,6 +1197,7 @@ class Paper2EpubConverter:
         author: str = "Unknown",
         language: str = "en",
         save_markdown: bool = False,
+        figures: Optional[List[Dict[str, Any]]] = None,
     ) -> Path:
         """
         Convert academic PDF to EPUB format.
@@ -356,6 +1209,9 @@ class Paper2EpubConverter:
             author: Author name
             language: Language code
             save_markdown: Whether to save intermediate markdown file
+            figures: Figures already extracted with FigureExtractor.extract_images,
+                e.g. prefetched while the previous PDF was inferred (extracted from
+                the PDF if None; an empty list skips extraction)
 
         Returns:
             Path to created EPUB file
@@ -373,31 +1229,18 @@ class Paper2EpubConverter:
 
         logger.info(f"Starting conversion: {pdf_path.name} -> {output_path.name}")
 
-        # Step 1: Extract PDF to Markdown
-        markdown_content = self.extract_pdf_to_markdown(pdf_path)
-
-        # Step 2: Extract and integrate figures
-        images: List[Tuple[str, bytes]] = []
-        if self.extract_figures:
-            try:
-                extracted_images = self.figure_extractor.extract_images(pdf_path)
-                if extracted_images:
-                    markdown_content, images = self.figure_matcher.insert_images_into_markdown(
-                        markdown_content, extracted_images
-                    )
-                    logger.info(f"Integrated {len(images)} figures into document")
-            except Exception as e:
-                logger.warning(f"Figure extraction failed, continuing without figures: {e}")
+        # Steps 1-2: Extract per-page Markdown and integrate figures
+        pages, images = self.extract_document(pdf_path, figures=figures)
 
         # Optionally save markdown
         if save_markdown:
             markdown_path = pdf_path.with_suffix(".md")
-            markdown_path.write_text(markdown_content, encoding="utf-8")
+            markdown_path.write_text("\n\n".join(pages), encoding="utf-8")
             logger.info(f"Saved markdown: {markdown_path}")
 
-        # Step 3: Convert Markdown to EPUB
+        # Step 3: Convert Markdown to EPUB page by page
         self.markdown_to_epub(
-            markdown_content=markdown_content,
+            markdown_content=pages,
             output_path=output_path,
             title=title,
             author=author,
@@ -5,6 +5,8 @@ Figure extraction module using PyMuPDF for PDF image extraction
 import io
 import logging
 import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
 from typing import Any, Dict, List, Tuple, Union
 
@@ -13,6 +15,18 @@ from PIL import Image
 
 logger = logging.getLogger(__name__)
 
+# Extensions PyMuPDF reports for images already encoded in each output format
+_FORMAT_EXTENSIONS = {
+    "PNG": {"png"},
+    "JPEG": {"jpeg", "jpg"},
+}
+
+# Image modes each output format can be written in without conversion
+_SAVE_MODES = {
+    "PNG": {"1", "L", "LA", "I", "I;16", "P", "RGB", "RGBA"},
+    "JPEG": {"L", "RGB", "CMYK"},
+}
+
 
 class FigureExtractor:
     """
@@ -25,6 +39,7 @@ class FigureExtractor:
         min_height: int = 100,
         output_format: str = "PNG",
         quality: int = 95,
+        num_workers: int = 0,
     ):
         """
         Initialize figure extractor.
@@ -34,11 +49,14 @@ class FigureExtractor:
             min_height: Minimum image height to extract
             output_format: Output format for images (PNG, JPEG)
             quality: JPEG quality (1-100) if using JPEG format
+            num_workers: Worker processes splitting the pages between them
+                (0 or 1 extracts in the calling process)
         """
         self.min_width = min_width
         self.min_height = min_height
         self.output_format = output_format.upper()
         self.quality = quality
+        self.num_workers = num_workers
 
     def extract_images(self, pdf_path: Union[str, Path]) -> List[Dict[str, Any]]:
         """
@@ -52,79 +70,130 @@ class FigureExtractor:
             'width', 'height', 'format', 'xref'
         """
         pdf_path = Path(pdf_path)
-        images = []
 
         doc = fitz.open(str(pdf_path))
+        num_pages = len(doc)
+        workers = min(self.num_workers, num_pages)
+
+        if workers > 1:
+            # PyMuPDF documents cannot be shared between processes, so each
+            # worker opens the PDF itself and handles a contiguous page range
+            doc.close()
+            chunk_size = -(-num_pages // workers)
+            page_ranges = [
+                range(start, min(start + chunk_size, num_pages))
+                for start in range(0, num_pages, chunk_size)
+            ]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                # map keeps page order, which figure numbering relies on
+                results = pool.map(_extract_pages, repeat(self), repeat(str(pdf_path)), page_ranges)
+                images = [image for chunk in results for image in chunk]
+        else:
+            images = []
+            for page_num in range(num_pages):
+                images.extend(self._extract_page(doc, page_num))
+            doc.close()
 
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            image_list = page.get_images(full=True)
-
-            for img_index, img_info in enumerate(image_list):
-                xref = img_info[0]  # Image xref
-
-                try:
-                    base_image = doc.extract_image(xref)
-                    image_bytes = base_image["image"]
-                    image_ext = base_image["ext"]
-
-                    # Convert to PIL for processing
-                    pil_image = Image.open(io.BytesIO(image_bytes))
-                    width, height = pil_image.size
-
-                    # Filter small images (icons, decorations)
-                    if width < self.min_width or height < self.min_height:
-                        logger.debug(
-                            f"Skipping small image on page {page_num + 1}: " f"{width}x{height}"
-                        )
-                        continue
-
-                    # Convert to target format if needed
-                    output_bytes = self._convert_image(pil_image)
-
-                    images.append(
-                        {
-                            "page": page_num + 1,
-                            "index": img_index,
-                            "image_bytes": output_bytes,
-                            "width": width,
-                            "height": height,
-                            "format": self.output_format.lower(),
-                            "xref": xref,
-                            "original_format": image_ext,
-                        }
-                    )
+        logger.info(f"Extracted {len(images)} figures from {pdf_path.name}")
+        return images
 
-                    logger.debug(
-                        f"Extracted image {img_index} from page {page_num + 1}: "
-                        f"{width}x{height} ({image_ext})"
-                    )
+    def _extract_page(self, doc, page_num: int) -> List[Dict[str, Any]]:
+        """
+        Extract the images on one page that pass the size filter.
+
+        Args:
+            doc: Open PyMuPDF document
+            page_num: Zero-based page index
 
-                except Exception as e:
-                    logger.warning(
-                        f"Failed to extract image {img_index} from page " f"{page_num + 1}: {e}"
+        Returns:
+            Image dicts in the format returned by extract_images
+        """
+        images = []
+        page = doc[page_num]
+        image_list = page.get_images(full=True)
+
+        for img_index, img_info in enumerate(image_list):
+            xref = img_info[0]  # Image xref
+
+            try:
+                base_image = doc.extract_image(xref)
+                image_bytes = base_image["image"]
+                image_ext = base_image["ext"]
+
+                # PyMuPDF reports the size, so nothing is decoded for the filter
+                width = base_image["width"]
+                height = base_image["height"]
+
+                # Filter small images (icons, decorations)
+                if width < self.min_width or height < self.min_height:
+                    logger.debug(
+                        f"Skipping small image on page {page_num + 1}: " f"{width}x{height}"
                     )
                     continue
 
-        doc.close()
-        logger.info(f"Extracted {len(images)} figures from {pdf_path.name}")
+                # Keep the embedded bytes when they are already in the target
+                # format, re-encoding only when a conversion is needed
+                if image_ext.lower() in _FORMAT_EXTENSIONS.get(self.output_format, ()):
+                    output_bytes = image_bytes
+                else:
+                    output_bytes = self._convert_image(Image.open(io.BytesIO(image_bytes)))
+
+                images.append(
+                    {
+                        "page": page_num + 1,
+                        "index": img_index,
+                        "image_bytes": output_bytes,
+                        "width": width,
+                        "height": height,
+                        "format": self.output_format.lower(),
+                        "xref": xref,
+                        "original_format": image_ext,
+                    }
+                )
+
+                logger.debug(
+                    f"Extracted image {img_index} from page {page_num + 1}: "
+                    f"{width}x{height} ({image_ext})"
+                )
+
+            except Exception as e:
+                logger.warning(
+                    f"Failed to extract image {img_index} from page " f"{page_num + 1}: {e}"
+                )
+                continue
+
         return images
 
     def _convert_image(self, pil_image: Image.Image) -> bytes:
         """Convert PIL image to target format bytes."""
-        output = io.BytesIO()
+        # Only convert modes the encoder cannot write (e.g. CMYK to PNG, RGBA to JPEG)
+        if pil_image.mode not in _SAVE_MODES.get(self.output_format, ()):
+            pil_image = pil_image.convert("RGB")
 
+        output = io.BytesIO()
         if self.output_format == "JPEG":
-            # Convert RGBA to RGB for JPEG
-            if pil_image.mode in ("RGBA", "P"):
-                pil_image = pil_image.convert("RGB")
             pil_image.save(output, format="JPEG", quality=self.quality)
         else:
-            pil_image.save(output, format="PNG")
+            # Fastest zlib level: figures are stored, not deflated again, in the EPUB
+            pil_image.save(output, format="PNG", compress_level=1)
 
         return output.getvalue()
 
 
+def _extract_pages(
+    extractor: FigureExtractor, pdf_path: str, page_nums: range
+) -> List[Dict[str, Any]]:
+    """Extract images from a range of pages in a worker process."""
+    doc = fitz.open(pdf_path)
+    try:
+        images = []
+        for page_num in page_nums:
+            images.extend(extractor._extract_page(doc, page_num))
+        return images
+    finally:
+        doc.close()
+
+
 class FigureMatcher:
     """
     Matches extracted figures with figure references in markdown content.
@@ -140,7 +209,11 @@ class FigureMatcher:
     ]
 
     def __init__(self):
-        self.compiled_patterns = [re.compile(p, re.IGNORECASE) for p in self.FIGURE_PATTERNS]
+        # One alternation inside a lookahead: a single finditer pass tries every
+        # position, and at each one the first matching pattern wins, giving
+        # position-ordered references with at most one per position
+        alternation = "|".join(f"(?:{p})" for p in self.FIGURE_PATTERNS)
+        self.reference_pattern = re.compile(f"(?=({alternation}))", re.IGNORECASE)
 
     def find_figure_references(self, markdown: str) -> List[Dict[str, Any]]:
         """
@@ -154,25 +227,18 @@ class FigureMatcher:
         """
         references = []
 
-        for pattern in self.compiled_patterns:
-            for match in pattern.finditer(markdown):
-                references.append(
-                    {
-                        "figure_num": int(match.group(1)),
-                        "position": match.start(),
-                        "match_text": match.group(0),
-                    }
-                )
+        for match in self.reference_pattern.finditer(markdown):
+            # Group 1 is the whole reference, then one number group per pattern
+            figure_num = next(g for g in match.groups()[1:] if g is not None)
+            references.append(
+                {
+                    "figure_num": int(figure_num),
+                    "position": match.start(),
+                    "match_text": match.group(1),
+                }
+            )
 
-        # Sort by position and deduplicate by position
-        references.sort(key=lambda x: x["position"])
-        seen_positions = set()
-        deduplicated = []
-        for ref in references:
-            if ref["position"] not in seen_positions:
-                seen_positions.add(ref["position"])
-                deduplicated.append(ref)
-        return deduplicated
+        return references
 
     def insert_images_into_markdown(
         self,
@@ -194,39 +260,33 @@ class FigureMatcher:
         image_files: List[Tuple[str, bytes]] = []
         insertions = []
 
-        # Group images by page for sequential assignment
-        page_images: Dict[int, List[Dict[str, Any]]] = {}
-        for img in images:
-            page = img["page"]
-            if page not in page_images:
-                page_images[page] = []
-            page_images[page].append(img)
-
-        # Assign figure numbers sequentially
-        figure_num = 1
-        for page in sorted(page_images.keys()):
-            for img in page_images[page]:
-                filename = f"figure_{figure_num:03d}.{img['format']}"
-                image_files.append((filename, img["image_bytes"]))
-
-                insertions.append(
-                    {
-                        "figure_num": figure_num,
-                        "filename": filename,
-                        "page": page,
-                    }
-                )
-                figure_num += 1
+        # Number figures in page order. extract_images already returns images
+        # page by page, so only sort (stably, keeping order within a page)
+        # when that is not the case
+        pages = [img["page"] for img in images]
+        if any(prev > cur for prev, cur in zip(pages, pages[1:])):
+            images = sorted(images, key=lambda img: img["page"])
+
+        for figure_num, img in enumerate(images, 1):
+            filename = f"figure_{figure_num:03d}.{img['format']}"
+            image_files.append((filename, img["image_bytes"]))
+
+            insertions.append(
+                {
+                    "figure_num": figure_num,
+                    "filename": filename,
+                    "page": img["page"],
+                }
+            )
 
         # Add images section at the end of the document
         if insertions:
-            image_markdown = "\n\n## Figures\n\n"
-            for ins in insertions:
-                image_markdown += (
-                    f"![Figure {ins['figure_num']}]" f"({image_path_prefix}{ins['filename']})\n\n"
-                )
-
-            modified_markdown = markdown + image_markdown
+            parts = [markdown, "\n\n## Figures\n\n"]
+            parts.extend(
+                f"![Figure {ins['figure_num']}]({image_path_prefix}{ins['filename']})\n\n"
+                for ins in insertions
+            )
+            modified_markdown = "".join(parts)
         else:
             modified_markdown = markdown
 
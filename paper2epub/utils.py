@@ -3,11 +3,23 @@ Utility functions for paper2epub
 """
 
 import logging
+import os
+import tempfile
+import urllib.request
 from pathlib import Path
 from typing import Optional, Union
 
+from paper2epub.config import CACHE_DIR, MATHJAX_URL, MATHJAX_VERSION
+
 logger = logging.getLogger(__name__)
 
+# Units used by format_file_size, in steps of 1024
+_SIZE_UNITS = ("B", "KB", "MB", "GB", "TB")
+
+# Set once a MathJax download fails, so later EPUBs skip straight to the CDN
+# instead of each waiting for the timeout again
+_mathjax_download_failed = False
+
 
 # Custom Exceptions
 class Paper2EpubError(Exception):
@@ -103,11 +115,11 @@ def format_file_size(size_bytes: int) -> str:
     Returns:
         Formatted string (e.g., "1.5 MB")
     """
-    for unit in ["B", "KB", "MB", "GB"]:
-        if size_bytes < 1024.0:
-            return f"{size_bytes:.1f} {unit}"
-        size_bytes /= 1024.0
-    return f"{size_bytes:.1f} TB"
+    if size_bytes < 1024:
+        return f"{size_bytes:.1f} B"
+    # Each unit is 2**10 of the previous, so the bit length picks the unit directly
+    exponent = min((int(size_bytes).bit_length() - 1) // 10, len(_SIZE_UNITS) - 1)
+    return f"{size_bytes / (1 << (10 * exponent)):.1f} {_SIZE_UNITS[exponent]}"
 
 
 def extract_metadata_from_filename(filename: str) -> dict:
@@ -153,5 +165,59 @@ def get_device_info() -> dict:
     if info["cuda_available"]:
         info["cuda_device_count"] = torch.cuda.device_count()
         info["cuda_device_name"] = torch.cuda.get_device_name(0)
+        free, total = torch.cuda.mem_get_info(0)
+        info["cuda_memory_free"] = free
+        info["cuda_memory_total"] = total
 
     return info
+
+
+def load_mathjax(cache_dir: Path = CACHE_DIR, timeout: float = 10.0) -> Optional[bytes]:
+    """
+    Load the MathJax bundle, downloading it to the cache on first use.
+
+    A failed download is not retried for the rest of the process. Only the
+    core bundle is cached: extensions that MathJax autoloads for rarer TeX
+    commands are still fetched relative to its URL, so those need a network
+    connection when the EPUB is read.
+
+    Args:
+        cache_dir: Directory where the bundle is cached
+        timeout: Download timeout in seconds
+
+    Returns:
+        MathJax script bytes, or None if it could not be downloaded
+    """
+    global _mathjax_download_failed
+
+    cache_path = Path(cache_dir) / f"mathjax-{MATHJAX_VERSION}.js"
+    if cache_path.exists():
+        return cache_path.read_bytes()
+    if _mathjax_download_failed:
+        return None
+
+    try:
+        with urllib.request.urlopen(MATHJAX_URL, timeout=timeout) as response:
+            script = response.read()
+            expected = response.headers.get("Content-Length")
+        if expected is not None and int(expected) != len(script):
+            raise OSError(f"truncated download ({len(script)} of {expected} bytes)")
+    except Exception as e:
+        logger.warning(f"Could not download MathJax, falling back to CDN: {e}")
+        _mathjax_download_failed = True
+        return None
+
+    # Write to a temporary file next to the cache and rename it into place, so an
+    # interrupted write or a concurrent process never leaves a partial bundle behind
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=cache_path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(script)
+        os.replace(tmp_name, cache_path)
+    except OSError as e:
+        logger.warning(f"Could not cache MathJax: {e}")
+        Path(tmp_name).unlink(missing_ok=True)
+        return script
+    logger.info(f"Cached MathJax {MATHJAX_VERSION}: {cache_path}")
+    return script
@@ -2,36 +2,167 @@
 Shared pytest fixtures for paper2epub tests
 """
 
-import io
+import hashlib
+import pickle
+import struct
+import zlib
 from pathlib import Path
 from unittest.mock import MagicMock, Mock, patch
 
 import pytest
-from PIL import Image
+import torch
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    """Encode one PNG chunk: length, type, data and CRC."""
+    return (
+        struct.pack(">I", len(data))
+        + chunk_type
+        + data
+        + struct.pack(">I", zlib.crc32(chunk_type + data))
+    )
+
+
+def _encode_solid_png(width: int, height: int, rgb: tuple) -> bytes:
+    """Encode a solid-color 8-bit RGB PNG without going through PIL."""
+    # Each scanline starts with filter type 0 (None)
+    raw = (b"\x00" + bytes(rgb) * width) * height
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + _png_chunk(b"IDAT", zlib.compress(raw, 1))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+_SAMPLE_PNG = _encode_solid_png(200, 200, (255, 0, 0))
+_SMALL_PNG = _encode_solid_png(50, 50, (0, 0, 255))
+
+
+@pytest.fixture(autouse=True)
+def offline_mathjax():
+    """Avoid downloading MathJax when building EPUBs in tests."""
+    with patch("paper2epub.converter.load_mathjax", return_value=b"/* MathJax */") as mock:
+        yield mock
+
+
+@pytest.fixture(autouse=True)
+def clear_model_cache():
+    """Keep mocked models from leaking between tests through the model cache."""
+    from paper2epub.converter import _get_model
+
+    _get_model.cache_clear()
+    yield
+    _get_model.cache_clear()
 
 
 @pytest.fixture
-def sample_pdf_path():
-    """Path to test PDF file."""
+def real_pdf_path():
+    """Path to a real paper for end-to-end tests (not shipped with the repo)."""
     return Path(__file__).parent.parent / "inputs" / "deft.pdf"
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
+def sample_pdf_path(tmp_path_factory):
+    """Small generated PDF, written once per test session."""
+    import fitz
+
+    pdf_path = tmp_path_factory.mktemp("pdfs", numbered=False) / "sample.pdf"
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), "Test Title")
+    doc.save(str(pdf_path))
+    doc.close()
+    return pdf_path
+
+
+@pytest.fixture(scope="session")
+def epub_cache(tmp_path_factory):
+    """
+    Build EPUBs once per session, keyed by their inputs.
+
+    Returns a function taking (converter, markdown_content, title, author, images)
+    and returning the EPUB path. Only share it between converters that render
+    identically.
+    """
+    cache_dir = tmp_path_factory.mktemp("epubs")
+
+    def build(converter, markdown_content, title="Test Book", author="Test Author", images=None):
+        inputs = pickle.dumps((markdown_content, title, author, images))
+        output_path = cache_dir / f"{hashlib.blake2b(inputs, digest_size=16).hexdigest()}.epub"
+        if not output_path.exists():
+            converter.markdown_to_epub(
+                markdown_content=markdown_content,
+                output_path=output_path,
+                title=title,
+                author=author,
+                images=images,
+            )
+        return output_path
+
+    return build
+
+
+@pytest.fixture(scope="session")
 def sample_image_bytes():
-    """Generate sample PNG image bytes."""
-    img = Image.new("RGB", (200, 200), color="red")
-    buffer = io.BytesIO()
-    img.save(buffer, format="PNG")
-    return buffer.getvalue()
+    """Sample PNG image bytes (200x200 red)."""
+    return _SAMPLE_PNG
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def small_image_bytes():
-    """Generate small PNG image bytes (for filtering tests)."""
-    img = Image.new("RGB", (50, 50), color="blue")
-    buffer = io.BytesIO()
-    img.save(buffer, format="PNG")
-    return buffer.getvalue()
+    """Small PNG image bytes (50x50 blue, for filtering tests)."""
+    return _SMALL_PNG
+
+
+class FakeFitzPage:
+    """Stand-in for a PyMuPDF page holding one embedded image."""
+
+    def __init__(self, width: int, height: int, filter_name: str):
+        self._image_info = (1, 0, width, height, 8, "DeviceRGB", "", "Im1", filter_name, 0)
+
+    def get_images(self, full: bool = False):
+        return [self._image_info]
+
+
+class FakeFitzDoc:
+    """Stand-in for a PyMuPDF document with the same image on every page."""
+
+    def __init__(self, num_pages: int, image: dict, page: FakeFitzPage):
+        self._num_pages = num_pages
+        self._image = image
+        self._page = page
+        self.closed = False
+
+    def __len__(self):
+        return self._num_pages
+
+    def __getitem__(self, page_num: int):
+        return self._page
+
+    def extract_image(self, xref: int) -> dict:
+        return self._image
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@pytest.fixture
+def make_fake_doc():
+    """Factory for FakeFitzDoc documents, cheaper than configuring MagicMocks."""
+
+    def make(num_pages, image_bytes, width, height, ext="png"):
+        filter_name = "DCTDecode" if ext in ("jpg", "jpeg") else "FlateDecode"
+        image = {"image": image_bytes, "ext": ext, "width": width, "height": height}
+        return FakeFitzDoc(num_pages, image, FakeFitzPage(width, height, filter_name))
+
+    return make
 
 
 @pytest.fixture
@@ -49,23 +180,35 @@ def mock_fitz_document(sample_image_bytes):
     mock_doc.extract_image.return_value = {
         "image": sample_image_bytes,
         "ext": "png",
+        "width": 200,
+        "height": 200,
     }
     mock_doc.close = Mock()
 
     return mock_doc
 
 
+@pytest.fixture
+def mock_fitz_doc(make_fake_doc, sample_image_bytes):
+    """Patch PyMuPDF for figure extraction with a one-page, one-figure document."""
+    with patch("paper2epub.figure_extractor.fitz") as mock_fitz:
+        mock_fitz.open.return_value = make_fake_doc(1, sample_image_bytes, 200, 200)
+        yield mock_fitz
+
+
 @pytest.fixture
 def mock_nougat_model():
     """Mock Nougat model to avoid loading in CI."""
+    # A fresh instance per test, so attributes set by one test never leak into another
+    mock_instance = MagicMock()
+    mock_instance.eval.return_value = None
+    mock_instance.to.return_value = mock_instance
+    mock_instance.inference.return_value = {
+        "predictions": ["# Test Title\n\nTest content with Figure 1."]
+    }
+    mock_instance.encoder.prepare_input = MagicMock(return_value=MagicMock())
+
     with patch("nougat.NougatModel") as mock_model_class:
-        mock_instance = MagicMock()
-        mock_instance.eval.return_value = None
-        mock_instance.to.return_value = mock_instance
-        mock_instance.inference.return_value = {
-            "predictions": ["# Test Title\n\nTest content with Figure 1."]
-        }
-        mock_instance.encoder.prepare_input = MagicMock(return_value=MagicMock())
         mock_model_class.from_pretrained.return_value = mock_instance
         yield mock_model_class
 
@@ -73,8 +216,9 @@ def mock_nougat_model():
 @pytest.fixture
 def mock_checkpoint():
     """Mock checkpoint retrieval."""
-    with patch("nougat.utils.checkpoint.get_checkpoint") as mock:
-        mock.return_value = "/fake/checkpoint/path"
+    with patch(
+        "nougat.utils.checkpoint.get_checkpoint", return_value="/fake/checkpoint/path"
+    ) as mock:
         yield mock
 
 
@@ -84,6 +228,6 @@ def mock_lazy_dataset():
     with patch("nougat.utils.dataset.LazyDataset") as mock:
         mock_instance = MagicMock()
         mock_instance.__len__ = Mock(return_value=1)
-        mock_instance.__getitem__ = Mock(return_value=(MagicMock(), None))
+        mock_instance.__getitem__ = Mock(return_value=(torch.zeros(3, 8, 8), ""))
         mock.return_value = mock_instance
         yield mock
@@ -0,0 +1,141 @@
+"""
+Tests for optional inference backends
+"""
+
+import sys
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+import torch
+
+from paper2epub.backends import OnnxEncoder, enable_onnx_encoder, tensorrt_provider_options
+
+
+class TinyEncoder(torch.nn.Module):
+    """Small stand-in for the Nougat encoder."""
+
+    input_size = (8, 8)
+
+    def __init__(self):
+        super().__init__()
+        self.conv = torch.nn.Conv2d(3, 4, 3)
+
+    def forward(self, x):
+        return self.conv(x).flatten(2).transpose(1, 2)
+
+
+class TestOnnxBackend:
+    """Tests for the ONNX Runtime encoder backend."""
+
+    def test_fallback_without_onnxruntime(self):
+        """Test that PyTorch is kept when onnxruntime is missing."""
+        model = MagicMock()
+        original_forward = model.encoder.forward
+
+        with patch.dict(sys.modules, {"onnxruntime": None}):
+            assert enable_onnx_encoder(model, "0.1.0-small", "cpu") is False
+
+        assert model.encoder.forward is original_forward
+
+    def test_onnx_encoder_matches_torch(self, tmp_path):
+        """Test that the exported encoder reproduces PyTorch outputs."""
+        pytest.importorskip("onnxruntime")
+        pytest.importorskip("onnx")
+
+        model = MagicMock()
+        model.encoder = TinyEncoder().eval()
+        image = torch.rand(2, 3, 8, 8)
+        with torch.no_grad():
+            expected = model.encoder(image)
+
+        with patch("paper2epub.backends.CACHE_DIR", tmp_path):
+            assert enable_onnx_encoder(model, "test", "cpu") is True
+
+        assert (tmp_path / "nougat-test-encoder.onnx").exists()
+        result = model.encoder(image)
+        assert torch.allclose(result, expected, atol=1e-5)
+        # The replaced PyTorch weights are released
+        assert list(model.encoder.parameters()) == []
+
+    def test_interrupted_export_leaves_no_model(self, tmp_path):
+        """Test that a failed export does not leave a partial ONNX file behind."""
+        pytest.importorskip("onnxruntime")
+
+        def partial_export(module, args, path, **kwargs):
+            Path(path).write_bytes(b"truncated")
+            raise KeyboardInterrupt
+
+        model = MagicMock()
+        model.encoder = TinyEncoder().eval()
+
+        with (
+            patch("paper2epub.backends.CACHE_DIR", tmp_path),
+            patch("torch.onnx.export", side_effect=partial_export),
+            pytest.raises(KeyboardInterrupt),
+        ):
+            enable_onnx_encoder(model, "test", "cpu")
+
+        assert list(tmp_path.iterdir()) == []
+
+    def test_onnx_encoder_uses_io_binding(self, tmp_path):
+        """Test that inputs are bound in place instead of copied through run()."""
+        pytest.importorskip("onnxruntime")
+        pytest.importorskip("onnx")
+
+        model = MagicMock()
+        model.encoder = TinyEncoder().eval()
+        image = torch.rand(2, 3, 8, 8)
+        with torch.no_grad():
+            expected = model.encoder(image)
+
+        with patch("paper2epub.backends.CACHE_DIR", tmp_path):
+            enable_onnx_encoder(model, "test", "cpu")
+        # The first batch runs unbound to learn the output shape
+        model.encoder(image)
+        model.encoder.forward.session.run = MagicMock(side_effect=AssertionError("host copy"))
+
+        result = model.encoder(image.half())
+
+        assert result.dtype == torch.float16
+        assert torch.allclose(result.float(), expected, atol=1e-2)
+
+
+class TestTensorrtBackend:
+    """Tests for the TensorRT execution provider."""
+
+    def test_provider_options_profile(self):
+        """Test that the engine profile covers the encoder input size."""
+        options = tensorrt_provider_options([896, 672])
+
+        assert options["trt_fp16_enable"] is True
+        assert options["trt_profile_min_shapes"] == "image:1x3x896x672"
+        assert options["trt_profile_max_shapes"] == "image:10x3x896x672"
+
+    @pytest.mark.parametrize(
+        "available, expected",
+        [
+            (
+                ["TensorrtExecutionProvider", "CUDAExecutionProvider", "CPUExecutionProvider"],
+                ["TensorrtExecutionProvider", "CUDAExecutionProvider", "CPUExecutionProvider"],
+            ),
+            (
+                ["CUDAExecutionProvider", "CPUExecutionProvider"],
+                ["CUDAExecutionProvider", "CPUExecutionProvider"],
+            ),
+        ],
+    )
+    def test_provider_order(self, available, expected):
+        """Test that TensorRT is preferred when available and skipped otherwise."""
+        ort = MagicMock()
+        ort.get_available_providers.return_value = available
+        ort.InferenceSession.return_value.get_providers.return_value = expected
+
+        with patch.dict(sys.modules, {"onnxruntime": ort}):
+            encoder = OnnxEncoder("encoder.onnx", "cuda", tensorrt_provider_options([8, 8]))
+
+        providers = ort.InferenceSession.call_args.kwargs["providers"]
+        names = [p if isinstance(p, str) else p[0] for p in providers]
+        assert names == expected
+        # GPU batches are bound in place rather than copied through the host
+        assert "cuda" in encoder.bind_devices
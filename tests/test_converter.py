@@ -2,9 +2,25 @@
 Tests for the converter module
 """
 
+import threading
+import zipfile
+from contextlib import nullcontext
+from unittest.mock import MagicMock, Mock, patch
+
 import pytest
+import torch
 
-from paper2epub.converter import Paper2EpubConverter
+from paper2epub.converter import (
+    Paper2EpubConverter,
+    _cuda_alloc_conf,
+    _prefetch,
+    _quantize_int8,
+    _reduce_scores_on_device,
+    _reduce_step_scores,
+    _text_layer_pages,
+    _warmup,
+    release_models,
+)
 
 
 class TestPaper2EpubConverter:
@@ -21,6 +37,34 @@ class TestPaper2EpubConverter:
         converter = Paper2EpubConverter(device="cpu")
         assert converter.device == "cpu"
 
+    def test_init_does_not_load_model(self, mock_nougat_model):
+        """Test that the model is only loaded on first use"""
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+
+        assert converter._model_loaded is False
+        mock_nougat_model.from_pretrained.assert_not_called()
+
+    def test_device_from_env(self, monkeypatch):
+        """Test that PAPER2EPUB_DEVICE overrides auto-detection"""
+        monkeypatch.setenv("PAPER2EPUB_DEVICE", "cpu")
+        with patch("torch.cuda.is_available", return_value=True):
+            converter = Paper2EpubConverter(device=None)
+        assert converter.device == "cpu"
+
+    def test_explicit_device_overrides_env(self, monkeypatch):
+        """Test that an explicit device wins over PAPER2EPUB_DEVICE"""
+        monkeypatch.setenv("PAPER2EPUB_DEVICE", "mps")
+        converter = Paper2EpubConverter(device="cpu")
+        assert converter.device == "cpu"
+
+    def test_cuda_without_gpu_fails(self):
+        """Test that requesting CUDA without a visible GPU aborts early"""
+        with (
+            patch("torch.cuda.device_count", return_value=0),
+            pytest.raises(RuntimeError, match="no GPU"),
+        ):
+            Paper2EpubConverter(device="cuda")
+
     def test_model_tag(self):
         """Test model tag configuration"""
         converter = Paper2EpubConverter(model_tag="0.1.0-base")
@@ -32,4 +76,853 @@ class TestPaper2EpubConverter:
         with pytest.raises(FileNotFoundError):
             converter.extract_pdf_to_markdown("nonexistent.pdf")
 
+    def test_tensorrt_batch_size_clamped(self):
+        """Test that batches larger than the TensorRT engine profile are clamped"""
+        converter = Paper2EpubConverter(
+            device="cpu", batch_size=32, backend="tensorrt", extract_figures=False
+        )
+        assert converter.batch_size == 10
+
+    def test_invalid_backend(self):
+        """Test that unknown backends are rejected"""
+        with pytest.raises(ValueError):
+            Paper2EpubConverter(backend="tensorflow")
+
+    def test_markdown_to_epub_from_pages(self, tmp_path):
+        """Test EPUB creation from per-page markdown chunks"""
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+        output_path = tmp_path / "paged.epub"
+
+        converter.markdown_to_epub(
+            markdown_content=iter(["# Page One", "# Page Two"]),
+            output_path=output_path,
+        )
+
+        with zipfile.ZipFile(output_path) as zf:
+            content = zf.read("EPUB/content.xhtml").decode("utf-8")
+        assert "Page One" in content
+        assert "Page Two" in content
+
+    def test_convert_with_preextracted_figures(self, tmp_path, sample_image_bytes):
+        """Test that supplied figures are used instead of re-extracting"""
+        converter = Paper2EpubConverter(device="cpu", extract_figures=True)
+        converter.iter_page_markdown = Mock(return_value=iter(["# Page"]))
+        converter.figure_extractor.extract_images = Mock()
+        figures = [{"page": 1, "image_bytes": sample_image_bytes, "format": "png"}]
+
+        output_path = converter.convert(
+            pdf_path=tmp_path / "paper.pdf",
+            output_path=tmp_path / "paper.epub",
+            figures=figures,
+        )
+
+        converter.figure_extractor.extract_images.assert_not_called()
+        with zipfile.ZipFile(output_path) as zf:
+            assert "EPUB/images/figure_001.png" in zf.namelist()
+
+    @pytest.mark.parametrize("text_layer", [False, True])
+    def test_empty_prefetched_figures_not_reextracted(self, tmp_path, text_layer):
+        """Test that an empty prefetch result skips figure extraction"""
+        converter = Paper2EpubConverter(device="cpu", extract_figures=True, text_layer=text_layer)
+        converter.iter_page_markdown = Mock(return_value=iter(["# Page"]))
+        converter.figure_extractor.extract_images = Mock()
+
+        with patch("paper2epub.converter._text_layer_pages", return_value=None):
+            pages, images = converter.extract_document(tmp_path / "paper.pdf", figures=[])
+
+        converter.figure_extractor.extract_images.assert_not_called()
+        assert pages == ["# Page"]
+        assert images == []
+
+    def test_extract_document_does_not_write(self, tmp_path, sample_image_bytes):
+        """Test that extract_document returns pages and images without an EPUB"""
+        converter = Paper2EpubConverter(device="cpu", extract_figures=True)
+        converter.iter_page_markdown = Mock(return_value=iter(["# Page"]))
+        figures = [{"page": 1, "image_bytes": sample_image_bytes, "format": "png"}]
+
+        pages, images = converter.extract_document(tmp_path / "paper.pdf", figures=figures)
+
+        assert pages[0] == "# Page"
+        assert "figure_001.png" in pages[-1]
+        assert [name for name, _ in images] == ["figure_001.png"]
+        assert list(tmp_path.iterdir()) == []
+
+    def test_mathjax_bundled_in_epub(self, tmp_path):
+        """Test that MathJax is embedded and referenced locally"""
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+        output_path = tmp_path / "math.epub"
+
+        with patch("paper2epub.converter.latex2mathml", None):
+            converter.markdown_to_epub("$$x^2$$", output_path)
+
+        with zipfile.ZipFile(output_path) as zf:
+            assert zf.read("EPUB/js/mathjax.js") == b"/* MathJax */"
+            content = zf.read("EPUB/content.xhtml").decode("utf-8")
+        assert 'src="js/mathjax.js"' in content
+
+    def test_mathjax_skipped_for_dollars_in_code(self, tmp_path):
+        """Test that code and prices never make the EPUB bundle MathJax"""
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+        output_path = tmp_path / "code.epub"
+
+        with patch("paper2epub.converter.latex2mathml", None):
+            converter.markdown_to_epub(
+                ["Run `echo $HOME$`", "Cost: \\$5", "It costs $5 and $10 today."], output_path
+            )
+
+        with zipfile.ZipFile(output_path) as zf:
+            assert "EPUB/js/mathjax.js" not in zf.namelist()
+            content = zf.read("EPUB/content.xhtml").decode("utf-8")
+        assert "echo $HOME$" in content
+        assert "It costs $5 and $10 today." in content
+        assert "mathjax" not in content
+
+    def test_math_prerendered_to_mathml(self, tmp_path):
+        """Test that convertible math becomes MathML and MathJax is left out"""
+        pytest.importorskip("latex2mathml")
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+        output_path = tmp_path / "mathml.epub"
+
+        converter.markdown_to_epub("Inline \\(a_1 < b\\) and \\[\\frac{x}{y}\\]", output_path)
+
+        with zipfile.ZipFile(output_path) as zf:
+            names = zf.namelist()
+            content = zf.read("EPUB/content.xhtml").decode("utf-8")
+            opf = zf.read("EPUB/content.opf").decode("utf-8")
+        assert "EPUB/js/mathjax.js" not in names
+        assert '<math xmlns="http://www.w3.org/1998/Math/MathML" display="block">' in content
+        assert "mathjax" not in content
+        assert 'properties="mathml"' in opf
+
+    def test_unknown_latex_left_for_mathjax(self):
+        """Test that math latex2mathml cannot render stays as LaTeX"""
+        pytest.importorskip("latex2mathml")
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+
+        result, needs_mathjax = converter._markdown_to_html("Text \\(\\notacommand{x}\\)")
+
+        assert "\\(\\notacommand{x}\\)" in result
+        assert "<math" not in result
+        assert needs_mathjax
+
+    def test_image_media_types(self, tmp_path, sample_image_bytes, small_image_bytes):
+        """Test that image media types follow the file extension"""
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+        output_path = tmp_path / "images.epub"
+        images = [("a.JPG", sample_image_bytes), ("b.gif", small_image_bytes)]
+
+        converter.markdown_to_epub("# Images", output_path, images=images)
+
+        with zipfile.ZipFile(output_path) as zf:
+            opf = zf.read("EPUB/content.opf").decode("utf-8")
+        assert 'href="images/a.JPG" id="image_' in opf
+        assert 'media-type="image/jpeg"' in opf
+        assert 'media-type="image/gif"' in opf
+
+    def test_images_stored_uncompressed(self, tmp_path, sample_image_bytes):
+        """Test that images are stored while text entries are deflated"""
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+        output_path = tmp_path / "stored.epub"
+
+        converter.markdown_to_epub(
+            "# Images", output_path, images=[("figure_001.png", sample_image_bytes)]
+        )
+
+        with zipfile.ZipFile(output_path) as zf:
+            assert zf.getinfo("mimetype").compress_type == zipfile.ZIP_STORED
+            assert zf.getinfo("EPUB/images/figure_001.png").compress_type == zipfile.ZIP_STORED
+            assert zf.getinfo("EPUB/content.xhtml").compress_type == zipfile.ZIP_DEFLATED
+            assert zf.read("EPUB/images/figure_001.png") == sample_image_bytes
+
+    @pytest.mark.parametrize(
+        "filename, compress_type",
+        [
+            ("figure.jpg", zipfile.ZIP_STORED),
+            ("figure.gif", zipfile.ZIP_STORED),
+            ("figure.svg", zipfile.ZIP_DEFLATED),
+        ],
+    )
+    def test_compression_by_media_type(self, tmp_path, filename, compress_type):
+        """Test that only already-compressed image formats skip deflate"""
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+        output_path = tmp_path / "media.epub"
+
+        converter.markdown_to_epub("# Images", output_path, images=[(filename, b"data")])
+
+        with zipfile.ZipFile(output_path) as zf:
+            assert zf.getinfo(f"EPUB/images/{filename}").compress_type == compress_type
+
+    def test_duplicate_images_stored_once(self, tmp_path, sample_image_bytes, small_image_bytes):
+        """Test that identical image payloads share one file in the EPUB"""
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+        output_path = tmp_path / "dedup.epub"
+        markdown_content = (
+            "![a](images/figure_001.png)\n\n"
+            "![b](images/figure_002.png)\n\n"
+            "![c](images/figure_003.png)"
+        )
+        images = [
+            ("figure_001.png", sample_image_bytes),
+            ("figure_002.png", small_image_bytes),
+            ("figure_003.png", sample_image_bytes),
+        ]
+
+        converter.markdown_to_epub(markdown_content, output_path, images=images)
+
+        with zipfile.ZipFile(output_path) as zf:
+            names = zf.namelist()
+            content = zf.read("EPUB/content.xhtml").decode("utf-8")
+        assert "EPUB/images/figure_003.png" not in names
+        assert "EPUB/images/figure_002.png" in names
+        assert content.count('src="images/figure_001.png"') == 2
+
+    def test_model_shared_between_converters(self, mock_nougat_model, mock_checkpoint):
+        """Test that converters with the same settings load the model once"""
+        first = Paper2EpubConverter(device="cpu", extract_figures=False)
+        second = Paper2EpubConverter(device="cpu", extract_figures=False)
+        other = Paper2EpubConverter(model_tag="0.1.0-base", device="cpu", extract_figures=False)
+
+        assert first.model is second.model
+        _ = other.model
+
+        assert mock_nougat_model.from_pretrained.call_count == 2
+
+    def test_context_manager_releases_model(self, mock_nougat_model, mock_checkpoint):
+        """Test that leaving the with-block unloads the model"""
+        with Paper2EpubConverter(device="cpu", extract_figures=False) as converter:
+            _ = converter.model
+            assert converter._model_loaded is True
+
+        assert converter._model is None
+        assert converter._model_loaded is False
+
+    def test_close_keeps_shared_model(self, mock_nougat_model, mock_checkpoint):
+        """Test that closing one converter does not evict the model others use"""
+        first = Paper2EpubConverter(device="cpu", extract_figures=False)
+        second = Paper2EpubConverter(device="cpu", extract_figures=False)
+        _ = first.model
+        first._copy_stream = MagicMock()
+
+        first.close()
+        _ = second.model
+
+        assert first._copy_stream is None
+        assert mock_nougat_model.from_pretrained.call_count == 1
+
+        release_models()
+        _ = Paper2EpubConverter(device="cpu", extract_figures=False).model
+        assert mock_nougat_model.from_pretrained.call_count == 2
+
     # Add more tests here
+
+
+class TestBatchedInference:
+    """Tests for batched Nougat inference"""
+
+    @staticmethod
+    def _make_converter(batch_size=2):
+        converter = Paper2EpubConverter(device="cpu", batch_size=batch_size, extract_figures=False)
+        model = MagicMock()
+        model.inference.side_effect = lambda image_tensors, return_attentions: {
+            "predictions": [f"Page {i}" for i in range(len(image_tensors))]
+        }
+        converter._model = model
+        converter._model_loaded = True
+        return converter, model
+
+    @staticmethod
+    def _patch_dataset(pages):
+        dataset = MagicMock()
+        dataset.__len__ = Mock(return_value=len(pages))
+        dataset.__getitem__ = Mock(side_effect=lambda i: (pages[i], ""))
+        return patch("nougat.utils.dataset.LazyDataset", return_value=dataset)
+
+    def test_pages_are_batched(self, tmp_path):
+        """Test that pages are stacked into batch_size-sized inference calls"""
+        pdf_path = tmp_path / "paper.pdf"
+        pdf_path.write_bytes(b"%PDF-1.4")
+        converter, model = self._make_converter(batch_size=2)
+        pages = [torch.zeros(3, 8, 8) for _ in range(3)]
+
+        with self._patch_dataset(pages):
+            markdown = converter.extract_pdf_to_markdown(pdf_path)
+
+        batch_shapes = [c.kwargs["image_tensors"].shape[0] for c in model.inference.call_args_list]
+        assert batch_shapes == [2, 1]
+        assert markdown.count("Page") == 3
+
+    def test_page_order_preserved(self, tmp_path):
+        """Test that threaded postprocessing keeps pages in document order"""
+        pdf_path = tmp_path / "paper.pdf"
+        pdf_path.write_bytes(b"%PDF-1.4")
+        converter, model = self._make_converter(batch_size=2)
+        counter = iter(range(100))
+        model.inference.side_effect = lambda image_tensors, return_attentions: {
+            "predictions": [f"Page {next(counter)}" for _ in range(len(image_tensors))]
+        }
+        pages = [torch.zeros(3, 8, 8) for _ in range(7)]
+
+        with self._patch_dataset(pages):
+            result = list(converter.iter_page_markdown(pdf_path))
+
+        assert result == [f"Page {i}" for i in range(7)]
+
+    def test_unrendered_pages_are_skipped(self, tmp_path):
+        """Test that pages which failed to render are dropped from the batch"""
+        pdf_path = tmp_path / "paper.pdf"
+        pdf_path.write_bytes(b"%PDF-1.4")
+        converter, model = self._make_converter(batch_size=4)
+        pages = [torch.zeros(3, 8, 8), None, torch.zeros(3, 8, 8)]
+
+        with self._patch_dataset(pages):
+            converter.extract_pdf_to_markdown(pdf_path)
+
+        assert model.inference.call_count == 1
+        assert model.inference.call_args.kwargs["image_tensors"].shape[0] == 2
+
+    def test_oom_halves_batch_size(self):
+        """Test that a CUDA OOM splits the batch and lowers batch_size"""
+        converter, model = self._make_converter(batch_size=4)
+        calls = []
+
+        def inference(image_tensors, return_attentions):
+            calls.append(len(image_tensors))
+            if len(image_tensors) > 2:
+                raise torch.cuda.OutOfMemoryError("out of memory")
+            return {"predictions": ["x"] * len(image_tensors)}
+
+        model.inference.side_effect = inference
+        with patch("torch.cuda.empty_cache"):
+            predictions = converter._run_inference(torch.zeros(4, 3, 8, 8))
+
+        assert calls == [4, 2, 2]
+        assert predictions == ["x"] * 4
+        assert converter.batch_size == 2
+
+
+class TestDefaultBatchSize:
+    """Tests for the batch size picked from GPU memory"""
+
+    def test_cpu_defaults_to_one(self):
+        """Test that CPU conversion processes one page at a time"""
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+        assert converter.batch_size == 1
+
+    def test_explicit_batch_size_kept(self):
+        """Test that an explicit batch size is not overridden"""
+        converter = Paper2EpubConverter(device="cpu", batch_size=3, extract_figures=False)
+        assert converter.batch_size == 3
+
+    @pytest.mark.parametrize("memory_gb, expected", [(4, 1), (24, 7), (80, 10)])
+    def test_cuda_scales_with_memory(self, memory_gb, expected):
+        """Test that the CUDA batch size follows total GPU memory, capped at 10"""
+        props = Mock(total_memory=memory_gb * 1024**3)
+        with (
+            patch.object(Paper2EpubConverter, "_check_cuda"),
+            patch("torch.cuda.is_available", return_value=True),
+            patch("torch.cuda.get_device_properties", return_value=props),
+        ):
+            converter = Paper2EpubConverter(device="cuda", extract_figures=False)
+
+        assert converter.batch_size == expected
+
+
+class TestPrecision:
+    """Tests for reduced-precision inference"""
+
+    def test_cpu_stays_fp32(self, mock_nougat_model, mock_checkpoint):
+        """Test that the model is not cast on CPU"""
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+        _ = converter.model
+
+        model = mock_nougat_model.from_pretrained.return_value
+        model.to.assert_called_once_with("cpu")
+        assert converter._dtype == torch.float32
+
+    @pytest.mark.parametrize("bf16, expected", [(True, torch.bfloat16), (False, torch.float16)])
+    def test_cuda_half_precision(self, mock_nougat_model, mock_checkpoint, bf16, expected):
+        """Test that the model is cast to bf16/fp16 on CUDA"""
+        with patch.object(Paper2EpubConverter, "_check_cuda"):
+            converter = Paper2EpubConverter(device="cuda", extract_figures=False)
+        with (
+            patch("torch.cuda.is_bf16_supported", return_value=bf16),
+            patch("paper2epub.converter._warmup"),
+        ):
+            _ = converter.model
+
+        model = mock_nougat_model.from_pretrained.return_value
+        model.to.assert_called_with(expected)
+        assert converter._dtype == expected
+
+    @pytest.mark.parametrize("backend, channels_last", [("torch", True), ("onnx", False)])
+    def test_cuda_encoder_channels_last(
+        self, mock_nougat_model, mock_checkpoint, backend, channels_last
+    ):
+        """Test that the CUDA encoder uses channels-last weights with the torch backend"""
+        with patch.object(Paper2EpubConverter, "_check_cuda"):
+            converter = Paper2EpubConverter(
+                device="cuda", batch_size=1, backend=backend, extract_figures=False
+            )
+        with (
+            patch("torch.cuda.is_bf16_supported", return_value=True),
+            patch("paper2epub.converter.enable_onnx_encoder"),
+            patch("paper2epub.converter._warmup"),
+        ):
+            _ = converter.model
+
+        encoder = mock_nougat_model.from_pretrained.return_value.encoder
+        calls = [c.kwargs.get("memory_format") for c in encoder.to.call_args_list]
+        assert (torch.channels_last in calls) is channels_last
+
+    @pytest.mark.filterwarnings("ignore:CUDA is not available")
+    def test_autocast_only_on_cuda(self):
+        """Test that inference autocasts to the model dtype on CUDA only"""
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+        assert not isinstance(converter._autocast(), torch.autocast)
+
+        with patch.object(Paper2EpubConverter, "_check_cuda"):
+            converter = Paper2EpubConverter(device="cuda", batch_size=1, extract_figures=False)
+        converter._dtype = torch.bfloat16
+
+        autocast = converter._autocast()
+        assert isinstance(autocast, torch.autocast)
+        assert autocast.fast_dtype == torch.bfloat16
+
+    def test_warmup_only_on_cuda(self, mock_nougat_model, mock_checkpoint):
+        """Test that the dummy warm-up batch is skipped off CUDA"""
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+        with patch("paper2epub.converter._warmup") as mock_warmup:
+            _ = converter.model
+
+        mock_warmup.assert_not_called()
+
+    def test_warmup_cached_with_model(self, mock_nougat_model, mock_checkpoint):
+        """Test that converters sharing a cached model warm it up only once"""
+        with patch.object(Paper2EpubConverter, "_check_cuda"):
+            converters = [
+                Paper2EpubConverter(device="cuda", batch_size=1, extract_figures=False)
+                for _ in range(2)
+            ]
+        with (
+            patch("torch.cuda.is_bf16_supported", return_value=True),
+            patch("paper2epub.converter._warmup") as mock_warmup,
+        ):
+            for converter in converters:
+                _ = converter.model
+
+        model = mock_nougat_model.from_pretrained.return_value
+        mock_warmup.assert_called_once_with(model.to.return_value, "cuda", torch.bfloat16, 1)
+
+    def test_warmup_uses_converter_batch_size(self, mock_nougat_model, mock_checkpoint):
+        """Test that the warm-up batch matches the batch size the converter will run"""
+        with patch.object(Paper2EpubConverter, "_check_cuda"):
+            converter = Paper2EpubConverter(device="cuda", batch_size=6, extract_figures=False)
+        with (
+            patch("torch.cuda.is_bf16_supported", return_value=True),
+            patch("paper2epub.converter._warmup") as mock_warmup,
+        ):
+            _ = converter.model
+
+        assert mock_warmup.call_args.args[-1] == 6
+
+    def test_warmup_runs_encoder_sized_batch(self):
+        """Test that warm-up runs one batch at the encoder input size"""
+        model = MagicMock()
+        model.encoder.input_size = [8, 6]
+
+        benchmark = torch.backends.cudnn.benchmark
+        try:
+            _warmup(model, "cpu", torch.bfloat16, 2)
+            assert torch.backends.cudnn.benchmark is True
+        finally:
+            torch.backends.cudnn.benchmark = benchmark
+
+        (call,) = model.inference.call_args_list
+        assert call.kwargs["image_tensors"].shape == (2, 3, 8, 6)
+
+
+class TestPrefetch:
+    """Tests for background batch prefetching"""
+
+    def test_preserves_order(self):
+        """Test that prefetched items come out in order"""
+        assert list(_prefetch(iter(range(10)), 2)) == list(range(10))
+
+    def test_reraises_producer_error(self):
+        """Test that errors raised while producing reach the consumer"""
+
+        def failing():
+            yield 1
+            raise ValueError("bad page")
+
+        items = _prefetch(failing(), 2)
+        assert next(items) == 1
+        with pytest.raises(ValueError, match="bad page"):
+            next(items)
+
+    def test_early_close_stops_producer(self):
+        """Test that abandoning the iterator does not leave the producer blocked"""
+        threads = threading.active_count()
+        items = _prefetch(iter(range(100)), 1)
+        assert next(items) == 0
+        items.close()
+
+        assert threading.active_count() == threads
+
+
+class TestScoreReduction:
+    """Tests for reducing decoder scores before they leave the device"""
+
+    PAD, EOS = 1, 2
+
+    def test_reduced_scores_match_repetition_check(self):
+        """Test that max values and pad/EOS positions survive the reduction"""
+        scores = [torch.randn(3, 50) for _ in range(6)]
+        scores[2][0, self.PAD] = 100.0
+        scores[4][1, self.EOS] = 100.0
+
+        reduced = [_reduce_step_scores(s, (self.PAD, self.EOS)) for s in scores]
+        full = torch.stack(scores, 1).max(-1)
+        small = torch.stack(reduced, 1).max(-1)
+
+        assert small.values.shape == full.values.shape
+        assert torch.equal(small.values, full.values)
+        for token_id in (self.PAD, self.EOS):
+            assert torch.equal(small.indices == token_id, full.indices == token_id)
+        assert torch.stack(reduced, 1).shape[-1] == self.EOS + 2
+
+    def test_generate_wrapped(self):
+        """Test that generate() output carries the reduced scores"""
+        model = MagicMock()
+        model.decoder.tokenizer.pad_token_id = self.PAD
+        model.decoder.tokenizer.eos_token_id = self.EOS
+        output = MagicMock()
+        output.scores = (torch.randn(2, 50), torch.randn(2, 50))
+        original = model.decoder.model.generate
+        original.return_value = output
+
+        _reduce_scores_on_device(model)
+        result = model.decoder.model.generate(max_length=4)
+
+        original.assert_called_once_with(max_length=4)
+        assert [s.shape for s in result.scores] == [(2, self.EOS + 2)] * 2
+
+
+class TestQuantization:
+    """Tests for int8 weight quantization"""
+
+    def test_invalid_mode(self):
+        """Test that unknown quantization modes are rejected"""
+        with pytest.raises(ValueError, match="Unknown quantization"):
+            Paper2EpubConverter(device="cpu", quantize="int4")
+
+    def test_int8_applied_on_cpu(self, mock_nougat_model, mock_checkpoint):
+        """Test that int8 quantization is applied to the CPU model"""
+        converter = Paper2EpubConverter(device="cpu", quantize="int8", extract_figures=False)
+        with patch("paper2epub.converter._quantize_int8") as mock_quantize:
+            model = converter.model
+
+        mock_quantize.assert_called_once()
+        assert model is mock_quantize.return_value
+
+    def test_int8_skipped_off_cpu(self, mock_nougat_model, mock_checkpoint):
+        """Test that int8 quantization is not applied on MPS"""
+        converter = Paper2EpubConverter(device="mps", quantize="int8", extract_figures=False)
+        with patch("paper2epub.converter._quantize_int8") as mock_quantize:
+            _ = converter.model
+
+        mock_quantize.assert_not_called()
+
+    @pytest.mark.filterwarnings("ignore::UserWarning", "ignore::DeprecationWarning")
+    def test_linear_layers_quantized(self):
+        """Test that Linear layers are swapped for dynamic int8 ones"""
+        model = torch.nn.Sequential(torch.nn.Linear(8, 8), torch.nn.ReLU(), torch.nn.Linear(8, 2))
+        inputs = torch.randn(4, 8)
+
+        quantized = _quantize_int8(model)
+
+        assert isinstance(quantized[0], torch.ao.nn.quantized.dynamic.Linear)
+        assert torch.allclose(quantized(inputs), model(inputs), atol=0.1)
+
+
+class TestParallelRasterization:
+    """Tests for worker-process page rasterization"""
+
+    def test_worker_pool_feeds_batches(self, tmp_path):
+        """Test that pages rasterized by worker processes are batched in order"""
+        fitz = pytest.importorskip("fitz")
+        pdf_path = tmp_path / "paper.pdf"
+        doc = fitz.open()
+        for _ in range(3):
+            doc.new_page()
+        doc.save(str(pdf_path))
+        doc.close()
+
+        converter = Paper2EpubConverter(
+            device="cpu", batch_size=2, num_workers=2, extract_figures=False
+        )
+        model = MagicMock()
+        model.encoder.prepare_input = lambda image: torch.zeros(3, 8, 8)
+        model.inference.side_effect = lambda image_tensors, return_attentions: {
+            "predictions": ["Page"] * len(image_tensors)
+        }
+        converter._model = model
+        converter._model_loaded = True
+
+        markdown = converter.extract_pdf_to_markdown(pdf_path)
+
+        batch_shapes = [c.kwargs["image_tensors"].shape[0] for c in model.inference.call_args_list]
+        assert batch_shapes == [2, 1]
+        assert markdown.count("Page") == 3
+
+    def test_abandoned_generator_stops_workers(self, tmp_path):
+        """Test that closing the batch generator early shuts down its threads and workers"""
+        fitz = pytest.importorskip("fitz")
+        pdf_path = tmp_path / "paper.pdf"
+        doc = fitz.open()
+        for _ in range(8):
+            doc.new_page()
+        doc.save(str(pdf_path))
+        doc.close()
+
+        converter = Paper2EpubConverter(
+            device="cpu", batch_size=1, num_workers=2, extract_figures=False
+        )
+        threads_before = threading.active_count()
+
+        batches = converter._iter_rasterized_batches(
+            pdf_path, 8, lambda image: torch.zeros(3, 8, 8)
+        )
+        image_tensors, rendered = next(batches)
+        batches.close()
+
+        assert image_tensors.shape[0] == 1
+        assert rendered == [True]
+        # The prefetch thread and the pool's management thread are gone
+        assert threading.active_count() == threads_before
+
+
+class TestCompile:
+    """Tests for torch.compile integration"""
+
+    def test_compile_skipped_on_cpu(self, mock_nougat_model, mock_checkpoint):
+        """Test that torch.compile is not applied off CUDA"""
+        converter = Paper2EpubConverter(device="cpu", compile_model=True, extract_figures=False)
+        with patch("torch.compile") as mock_compile:
+            _ = converter.model
+
+        mock_compile.assert_not_called()
+        assert converter._model_loaded is True
+
+
+class TestTextLayer:
+    """Tests for the embedded text layer fast path"""
+
+    @staticmethod
+    def _make_pdf(path, lines_per_page):
+        """Write a PDF whose pages carry the given number of text lines"""
+        fitz = pytest.importorskip("fitz")
+        doc = fitz.open()
+        for _ in range(2):
+            page = doc.new_page()
+            for i in range(lines_per_page):
+                page.insert_text((50, 50 + 14 * i), "The quick brown fox jumps over the lazy dog.")
+        doc.save(str(path))
+        doc.close()
+        return path
+
+    def test_text_pdf_uses_text_layer(self, tmp_path):
+        """Test that a text-heavy PDF yields one Markdown string per page"""
+        pdf_path = self._make_pdf(tmp_path / "paper.pdf", lines_per_page=20)
+
+        pages = _text_layer_pages(pdf_path)
+
+        assert len(pages) == 2
+        assert "quick brown fox" in pages[0]
+
+    def test_sparse_text_falls_back(self, tmp_path):
+        """Test that PDFs with little embedded text go through Nougat"""
+        pdf_path = self._make_pdf(tmp_path / "scan.pdf", lines_per_page=1)
+
+        assert _text_layer_pages(pdf_path) is None
+
+    def test_math_font_falls_back(self):
+        """Test that typeset math fonts send the PDF through Nougat"""
+        page = MagicMock()
+        page.number = 0
+        page.get_fonts.return_value = [(5, "pfa", "Type1", "CMMI10", "F1", "")]
+        doc = MagicMock()
+        doc.__enter__.return_value = doc
+        doc.__len__.return_value = 1
+        doc.__iter__.return_value = iter([page])
+
+        with patch("paper2epub.converter.fitz") as mock_fitz:
+            mock_fitz.open.return_value = doc
+            assert _text_layer_pages("paper.pdf") is None
+
+        page.get_text.assert_not_called()
+
+    def test_text_layer_markup_shown_literally(self):
+        """Test that Markdown and math syntax in PDF text is not interpreted"""
+        lines = ["# Not a heading", "* not a list", "1. not an item", "> not a quote"]
+        blocks = [(0, 0, 0, 0, line, i, 0) for i, line in enumerate(lines)]
+        blocks.append((0, 0, 0, 0, "costs $$x$$ and \\(y\\) <b> `z`", 9, 0))
+        page = MagicMock()
+        page.get_fonts.return_value = []
+        page.get_text.return_value = blocks
+        doc = MagicMock()
+        doc.__enter__.return_value = doc
+        doc.__len__.return_value = 1
+        doc.__iter__.return_value = iter([page])
+
+        with (
+            patch("paper2epub.converter.fitz") as mock_fitz,
+            patch("paper2epub.converter._MIN_TEXT_CHARS_PER_PAGE", 1),
+        ):
+            mock_fitz.open.return_value = doc
+            (page_markdown,) = _text_layer_pages("paper.pdf")
+
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+        result, needs_mathjax = converter._markdown_to_html(page_markdown)
+
+        assert not needs_mathjax
+        for tag in ("<h1", "<li", "<blockquote", "<math", "<b>", "<code"):
+            assert tag not in result
+        assert "# Not a heading" in result
+        assert "&lt;b&gt;" in result
+
+    def test_extract_document_skips_nougat(self, tmp_path):
+        """Test that the text layer replaces Nougat extraction when enabled"""
+        pdf_path = self._make_pdf(tmp_path / "paper.pdf", lines_per_page=20)
+        converter = Paper2EpubConverter(device="cpu", text_layer=True, extract_figures=False)
+
+        with patch.object(converter, "iter_page_markdown") as mock_iter:
+            pages, images = converter.extract_document(pdf_path)
+
+        mock_iter.assert_not_called()
+        assert len(pages) == 2
+        assert images == []
+
+    def test_text_layer_probed_before_figures(self, tmp_path):
+        """Test that PyMuPDF is never used from two threads at once"""
+        pdf_path = self._make_pdf(tmp_path / "paper.pdf", lines_per_page=20)
+        converter = Paper2EpubConverter(device="cpu", text_layer=True)
+        calls = []
+
+        def probe(path):
+            calls.append(("probe", threading.current_thread()))
+            return _text_layer_pages(path)
+
+        def extract(path):
+            calls.append(("figures", threading.current_thread()))
+            return []
+
+        with (
+            patch("paper2epub.converter._text_layer_pages", side_effect=probe),
+            patch.object(converter.figure_extractor, "extract_images", side_effect=extract),
+        ):
+            converter.extract_document(pdf_path)
+
+        assert [name for name, _ in calls] == ["probe", "figures"]
+        assert all(thread is threading.main_thread() for _, thread in calls)
+
+
+class TestMarkdownRendering:
+    """Tests for markdown to HTML rendering"""
+
+    def test_cmarkgfm_preserves_math(self):
+        """Test that LaTeX math is not mangled by the C renderer"""
+        pytest.importorskip("cmarkgfm")
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+
+        with patch("paper2epub.converter.latex2mathml", None):
+            result, _ = converter._markdown_to_html("Inline \\(a_1 * b_2\\) and $$x_1 * y_1 < 3$$.")
+
+        assert "\\(a_1 * b_2\\)" in result
+        assert "$$x_1 * y_1 &lt; 3$$" in result
+        assert "<em>" not in result
+
+    @pytest.mark.parametrize("use_cmarkgfm", [True, False])
+    def test_code_not_treated_as_math(self, use_cmarkgfm):
+        """Test that dollar signs in code spans and fenced blocks stay literal"""
+        if use_cmarkgfm:
+            pytest.importorskip("cmarkgfm")
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+        text = "Run `echo $HOME$` first.\n\n```sh\nexport A=$B$ \\(x\\)\n```\n\nThen \\(y\\)."
+
+        with (
+            patch("paper2epub.converter._math_to_mathml", return_value="<math/>") as mock_math,
+            nullcontext() if use_cmarkgfm else patch("paper2epub.converter.cmarkgfm", None),
+        ):
+            result, needs_mathjax = converter._markdown_to_html(text)
+
+        assert not needs_mathjax
+        mock_math.assert_called_once_with("\\(y\\)")
+        # Pygments may split the fenced block into spans, so only the math call is checked there
+        assert "<code>echo $HOME$</code>" in result
+        assert result.count("<math/>") == 1
+
+    @pytest.mark.parametrize(
+        "text, expected",
+        [
+            ("It costs $5 and $10 today.", "It costs $5 and $10 today."),
+            ("Price is $3.50 and tax $0.20", "Price is $3.50 and tax $0.20"),
+        ],
+    )
+    def test_currency_not_treated_as_math(self, text, expected):
+        """Test that dollar amounts in prose are left as text"""
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+
+        with patch("paper2epub.converter._math_to_mathml") as mock_math:
+            result, needs_mathjax = converter._markdown_to_html(text)
+
+        mock_math.assert_not_called()
+        assert expected in result
+        assert not needs_mathjax
+
+    def test_rendered_pages_cached(self, tmp_path):
+        """Test that re-converting the same pages reuses the rendered HTML"""
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+        pages = ["# Title", "Body text", "Body text"]
+
+        converter.markdown_to_epub(pages, tmp_path / "first.epub")
+        converter.markdown_to_epub(pages, tmp_path / "second.epub")
+
+        info = converter._render_html.cache_info()
+        assert info.misses == 2
+        assert info.hits == 4
+
+    def test_render_cache_skips_documents_and_clears_on_close(self, tmp_path):
+        """Test that whole documents are not cached and close() empties the page cache"""
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+
+        converter.markdown_to_epub("# Title\n\nBody text", tmp_path / "doc.epub")
+        assert converter._render_html.cache_info().currsize == 0
+
+        converter.markdown_to_epub(["# Title", "Body text"], tmp_path / "pages.epub")
+        assert converter._render_html.cache_info().currsize == 2
+
+        converter.close()
+        assert converter._render_html.cache_info().currsize == 0
+
+    def test_fallback_to_python_markdown(self):
+        """Test rendering when cmarkgfm is not installed"""
+        converter = Paper2EpubConverter(device="cpu", extract_figures=False)
+        with patch("paper2epub.converter.cmarkgfm", None):
+            result, _ = converter._markdown_to_html("| a | b |\n|---|---|\n| 1 | 2 |")
+        assert "<table>" in result
+
+
+class TestCudaAllocConf:
+    """Tests for the CUDA caching allocator settings"""
+
+    @pytest.mark.parametrize(
+        "version, expandable",
+        [("2.0.1+cu118", False), ("2.1.0", True), ("2.10.0", True), ("10.0.0", True)],
+    )
+    def test_expandable_segments_by_version(self, version, expandable):
+        """Test that the version gate compares release numbers, not strings"""
+        conf = _cuda_alloc_conf(version)
+
+        assert conf.startswith("max_split_size_mb:128")
+        assert ("expandable_segments:True" in conf) is expandable
@@ -3,12 +3,42 @@ Tests for figure extraction module
 """
 
 import io
-from unittest.mock import MagicMock, Mock, patch
+import struct
+from unittest.mock import patch
 
+import pytest
 from PIL import Image
 
 from paper2epub.figure_extractor import FigureExtractor, FigureMatcher
 
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPEG_SIGNATURE = b"\xff\xd8\xff"
+
+# Markdown samples for the reference-matching tests
+BASIC_MARKDOWN = "As shown in Figure 1, the results are clear. See also Fig. 2."
+VARIOUS_FORMATS_MARKDOWN = """
+Figure 1 shows results.
+As in Fig. 2 we can see.
+FIG. 3 demonstrates this.
+[Figure 4] is referenced.
+"""
+MIXED_CASE_MARKDOWN = "FIGURE 1, figure 2, Figure 3, FiGuRe 4"
+ORDERED_MARKDOWN = "See Fig. 3, then [Figure 1] and Figure 2."
+NO_REFERENCES_MARKDOWN = "This is a document without any figure references."
+
+
+def _jpeg_components(data: bytes) -> int:
+    """Read the color component count from a JPEG's start-of-frame header."""
+    pos = 2  # after the SOI marker
+    while pos < len(data):
+        marker = data[pos + 1]
+        (length,) = struct.unpack(">H", data[pos + 2 : pos + 4])
+        # SOF0-SOF2: length, precision, height, width, then the component count
+        if marker in (0xC0, 0xC1, 0xC2):
+            return data[pos + 9]
+        pos += 2 + length
+    raise ValueError("No start-of-frame marker found")
+
 
 class TestFigureExtractor:
     """Tests for FigureExtractor class."""
@@ -35,28 +65,15 @@ class TestFigureExtractor:
         assert extractor.quality == 80
 
     @patch("paper2epub.figure_extractor.fitz")
-    def test_extract_images(self, mock_fitz, sample_image_bytes):
+    def test_extract_images(self, mock_fitz, make_fake_doc, sample_image_bytes):
         """Test image extraction from PDF."""
-        # Setup mock document
-        mock_doc = MagicMock()
-        mock_doc.__len__ = Mock(return_value=1)
-
-        mock_page = MagicMock()
-        mock_page.get_images.return_value = [
-            (1, 0, 200, 200, 8, "DeviceRGB", "", "Im1", "FlateDecode", 0)
-        ]
-
-        mock_doc.__getitem__ = Mock(return_value=mock_page)
-        mock_doc.extract_image.return_value = {
-            "image": sample_image_bytes,
-            "ext": "png",
-        }
-        mock_doc.close = Mock()
-        mock_fitz.open.return_value = mock_doc
+        doc = make_fake_doc(1, sample_image_bytes, 200, 200)
+        mock_fitz.open.return_value = doc
 
         extractor = FigureExtractor()
         images = extractor.extract_images("test.pdf")
 
+        assert doc.closed
         assert len(images) == 1
         assert images[0]["page"] == 1
         assert "image_bytes" in images[0]
@@ -64,29 +81,39 @@ class TestFigureExtractor:
         assert images[0]["height"] == 200
 
     @patch("paper2epub.figure_extractor.fitz")
-    def test_filter_small_images(self, mock_fitz, small_image_bytes):
+    def test_filter_small_images(self, mock_fitz, make_fake_doc, small_image_bytes):
         """Test that small images are filtered out."""
-        mock_doc = MagicMock()
-        mock_doc.__len__ = Mock(return_value=1)
-
-        mock_page = MagicMock()
-        mock_page.get_images.return_value = [
-            (1, 0, 50, 50, 8, "DeviceRGB", "", "Im1", "FlateDecode", 0)
-        ]
-
-        mock_doc.__getitem__ = Mock(return_value=mock_page)
-        mock_doc.extract_image.return_value = {
-            "image": small_image_bytes,
-            "ext": "png",
-        }
-        mock_doc.close = Mock()
-        mock_fitz.open.return_value = mock_doc
+        mock_fitz.open.return_value = make_fake_doc(1, small_image_bytes, 50, 50)
 
         extractor = FigureExtractor(min_width=100, min_height=100)
         images = extractor.extract_images("test.pdf")
 
         assert len(images) == 0  # Small image should be filtered
 
+    @patch("paper2epub.figure_extractor.fitz")
+    def test_filter_uses_reported_size(self, mock_fitz, make_fake_doc, sample_image_bytes):
+        """Test that the size filter uses PyMuPDF's dimensions without decoding."""
+        mock_fitz.open.return_value = make_fake_doc(1, sample_image_bytes, 40, 40, ext="jpeg")
+
+        extractor = FigureExtractor(min_width=100, min_height=100)
+        with patch("paper2epub.figure_extractor.Image.open") as mock_open:
+            images = extractor.extract_images("test.pdf")
+
+        assert images == []
+        mock_open.assert_not_called()
+
+    @patch("paper2epub.figure_extractor.fitz")
+    def test_matching_format_passed_through(self, mock_fitz, make_fake_doc, sample_image_bytes):
+        """Test that images already in the output format are not re-encoded."""
+        mock_fitz.open.return_value = make_fake_doc(1, sample_image_bytes, 200, 200)
+
+        extractor = FigureExtractor(output_format="PNG")
+        with patch.object(extractor, "_convert_image") as mock_convert:
+            images = extractor.extract_images("test.pdf")
+
+        mock_convert.assert_not_called()
+        assert images[0]["image_bytes"] == sample_image_bytes
+
     def test_convert_image_png(self, sample_image_bytes):
         """Test PNG image conversion."""
         extractor = FigureExtractor(output_format="PNG")
@@ -95,9 +122,7 @@ class TestFigureExtractor:
 
         assert result is not None
         assert len(result) > 0
-        # Verify it's valid PNG
-        result_img = Image.open(io.BytesIO(result))
-        assert result_img.format == "PNG"
+        assert result[:8] == PNG_SIGNATURE
 
     def test_convert_image_jpeg(self):
         """Test JPEG conversion from RGBA."""
@@ -106,29 +131,38 @@ class TestFigureExtractor:
         img = Image.new("RGBA", (100, 100), color=(255, 0, 0, 128))
         result = extractor._convert_image(img)
 
-        # Verify it's valid JPEG (RGBA converted to RGB)
-        result_img = Image.open(io.BytesIO(result))
-        assert result_img.format == "JPEG"
+        # Verify it's valid JPEG (RGBA converted to three-component RGB)
+        assert len(result) > 0
+        assert result[:3] == JPEG_SIGNATURE
+        assert _jpeg_components(result) == 3
+
+    @pytest.mark.parametrize(
+        "output_format, mode",
+        [("PNG", "CMYK"), ("JPEG", "LA"), ("JPEG", "P")],
+    )
+    def test_convert_unsupported_mode(self, output_format, mode):
+        """Test that modes the encoder cannot write are converted to RGB."""
+        extractor = FigureExtractor(output_format=output_format)
+        img = Image.new(mode, (20, 20))
+
+        result_img = Image.open(io.BytesIO(extractor._convert_image(img)))
+
+        assert result_img.format == output_format
         assert result_img.mode == "RGB"
 
-    @patch("paper2epub.figure_extractor.fitz")
-    def test_extract_multiple_pages(self, mock_fitz, sample_image_bytes):
-        """Test extraction from multiple pages."""
-        mock_doc = MagicMock()
-        mock_doc.__len__ = Mock(return_value=3)
+    def test_convert_keeps_grayscale(self):
+        """Test that grayscale images are not expanded to RGB."""
+        extractor = FigureExtractor(output_format="PNG")
+        img = Image.new("L", (20, 20))
 
-        mock_page = MagicMock()
-        mock_page.get_images.return_value = [
-            (1, 0, 200, 200, 8, "DeviceRGB", "", "Im1", "FlateDecode", 0)
-        ]
+        result_img = Image.open(io.BytesIO(extractor._convert_image(img)))
+
+        assert result_img.mode == "L"
 
-        mock_doc.__getitem__ = Mock(return_value=mock_page)
-        mock_doc.extract_image.return_value = {
-            "image": sample_image_bytes,
-            "ext": "png",
-        }
-        mock_doc.close = Mock()
-        mock_fitz.open.return_value = mock_doc
+    @patch("paper2epub.figure_extractor.fitz")
+    def test_extract_multiple_pages(self, mock_fitz, make_fake_doc, sample_image_bytes):
+        """Test extraction from multiple pages."""
+        mock_fitz.open.return_value = make_fake_doc(3, sample_image_bytes, 200, 200)
 
         extractor = FigureExtractor()
         images = extractor.extract_images("test.pdf")
@@ -139,60 +173,63 @@ class TestFigureExtractor:
         assert images[1]["page"] == 2
         assert images[2]["page"] == 3
 
+    def test_worker_processes_match_serial(self, tmp_path, sample_image_bytes):
+        """Test that extraction with worker processes returns the same images in order."""
+        fitz = pytest.importorskip("fitz")
+        pdf_path = tmp_path / "figures.pdf"
+        doc = fitz.open()
+        for color in ["red", "green", "blue"]:
+            img = Image.new("RGB", (200, 200), color=color)
+            buffer = io.BytesIO()
+            img.save(buffer, format="PNG")
+            page = doc.new_page()
+            page.insert_image(fitz.Rect(0, 0, 200, 200), stream=buffer.getvalue())
+        doc.save(str(pdf_path))
+        doc.close()
 
-class TestFigureMatcher:
-    """Tests for FigureMatcher class."""
+        serial = FigureExtractor().extract_images(pdf_path)
+        parallel = FigureExtractor(num_workers=2).extract_images(pdf_path)
 
-    def test_find_figure_references_basic(self):
-        """Test finding basic figure references."""
-        matcher = FigureMatcher()
-        markdown = "As shown in Figure 1, the results are clear. See also Fig. 2."
+        assert [img["page"] for img in parallel] == [1, 2, 3]
+        assert [img["image_bytes"] for img in parallel] == [img["image_bytes"] for img in serial]
 
-        refs = matcher.find_figure_references(markdown)
 
-        assert len(refs) == 2
-        assert refs[0]["figure_num"] == 1
-        assert refs[1]["figure_num"] == 2
+@pytest.fixture(scope="class")
+def matcher():
+    """Matcher shared by a test class; it keeps no state between calls."""
+    return FigureMatcher()
 
-    def test_find_figure_references_various_formats(self):
-        """Test various figure reference formats."""
-        matcher = FigureMatcher()
-        markdown = """
-        Figure 1 shows results.
-        As in Fig. 2 we can see.
-        FIG. 3 demonstrates this.
-        [Figure 4] is referenced.
-        """
 
-        refs = matcher.find_figure_references(markdown)
-
-        figure_nums = [r["figure_num"] for r in refs]
-        assert 1 in figure_nums
-        assert 2 in figure_nums
-        assert 3 in figure_nums
-        assert 4 in figure_nums
-
-    def test_find_figure_references_case_insensitive(self):
-        """Test case insensitive matching."""
-        matcher = FigureMatcher()
-        markdown = "FIGURE 1, figure 2, Figure 3, FiGuRe 4"
+class TestFigureMatcher:
+    """Tests for FigureMatcher class."""
 
+    @pytest.mark.parametrize(
+        "markdown, expected_nums",
+        [
+            pytest.param(BASIC_MARKDOWN, [1, 2], id="basic"),
+            # "[Figure 4]" also matches as "Figure 4" one character later
+            pytest.param(VARIOUS_FORMATS_MARKDOWN, [1, 2, 3, 4, 4], id="various-formats"),
+            pytest.param(MIXED_CASE_MARKDOWN, [1, 2, 3, 4], id="case-insensitive"),
+            pytest.param(NO_REFERENCES_MARKDOWN, [], id="no-matches"),
+        ],
+    )
+    def test_find_figure_references(self, matcher, markdown, expected_nums):
+        """Test finding figure references across formats and letter cases."""
         refs = matcher.find_figure_references(markdown)
 
-        assert len(refs) >= 4
-
-    def test_find_figure_references_no_matches(self):
-        """Test when there are no figure references."""
-        matcher = FigureMatcher()
-        markdown = "This is a document without any figure references."
+        assert [r["figure_num"] for r in refs] == expected_nums
 
-        refs = matcher.find_figure_references(markdown)
+    def test_find_figure_references_ordered_by_position(self, matcher):
+        """Test that references come back in document order, one per position."""
+        refs = matcher.find_figure_references(ORDERED_MARKDOWN)
 
-        assert len(refs) == 0
+        positions = [r["position"] for r in refs]
+        assert positions == sorted(set(positions))
+        assert [r["figure_num"] for r in refs] == [3, 1, 1, 2]
+        assert refs[1]["match_text"] == "[Figure 1]"
 
-    def test_insert_images_into_markdown(self, sample_image_bytes):
+    def test_insert_images_into_markdown(self, matcher, sample_image_bytes):
         """Test image insertion into markdown."""
-        matcher = FigureMatcher()
         markdown = "# Test Paper\n\nAs shown in Figure 1."
         images = [
             {
@@ -213,9 +250,8 @@ class TestFigureMatcher:
         assert len(image_files) == 1
         assert image_files[0][0] == "figure_001.png"
 
-    def test_insert_multiple_images(self, sample_image_bytes):
+    def test_insert_multiple_images(self, matcher, sample_image_bytes):
         """Test inserting multiple images."""
-        matcher = FigureMatcher()
         markdown = "Content with multiple figures."
         images = [
             {
@@ -244,9 +280,8 @@ class TestFigureMatcher:
         assert "figure_001.png" in modified_md
         assert "figure_002.png" in modified_md
 
-    def test_insert_no_images(self):
+    def test_insert_no_images(self, matcher):
         """Test when there are no images to insert."""
-        matcher = FigureMatcher()
         markdown = "Content without images."
         images = []
 
@@ -255,9 +290,20 @@ class TestFigureMatcher:
         assert modified_md == markdown
         assert len(image_files) == 0
 
-    def test_images_sorted_by_page(self, sample_image_bytes):
+    def test_unordered_pages_keep_order_within_page(self, matcher):
+        """Test that sorting by page keeps the extraction order on each page."""
+        images = [
+            {"page": 2, "image_bytes": b"a", "format": "png"},
+            {"page": 1, "image_bytes": b"b", "format": "png"},
+            {"page": 2, "image_bytes": b"c", "format": "png"},
+        ]
+
+        _, image_files = matcher.insert_images_into_markdown("", images)
+
+        assert [data for _, data in image_files] == [b"b", b"a", b"c"]
+
+    def test_images_sorted_by_page(self, matcher, sample_image_bytes):
         """Test that images are sorted by page number."""
-        matcher = FigureMatcher()
         markdown = "Content."
         # Images in reverse order
         images = [
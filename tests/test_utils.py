@@ -2,16 +2,28 @@
 Tests for utility functions
 """
 
+import os
+from unittest.mock import MagicMock, patch
+
 import pytest
 
+from paper2epub import utils
+from paper2epub.config import MATHJAX_VERSION
 from paper2epub.utils import (
-    validate_pdf,
     ensure_output_path,
-    format_file_size,
     extract_metadata_from_filename,
+    format_file_size,
+    load_mathjax,
+    validate_pdf,
 )
 
 
+@pytest.fixture(autouse=True)
+def reset_mathjax_failure(monkeypatch):
+    """Forget MathJax download failures recorded by earlier tests."""
+    monkeypatch.setattr(utils, "_mathjax_download_failed", False)
+
+
 class TestUtils:
     """Test suite for utility functions"""
 
@@ -22,6 +34,15 @@ class TestUtils:
         assert format_file_size(1024 * 1024) == "1.0 MB"
         assert format_file_size(1024 * 1024 * 1024) == "1.0 GB"
 
+    def test_format_file_size_boundaries(self):
+        """Test file size formatting at unit boundaries"""
+        assert format_file_size(0) == "0.0 B"
+        assert format_file_size(1023) == "1023.0 B"
+        assert format_file_size(1536) == "1.5 KB"
+        assert format_file_size(1024**2 - 1) == "1024.0 KB"
+        assert format_file_size(1024**4) == "1.0 TB"
+        assert format_file_size(1024**5) == "1024.0 TB"
+
     def test_extract_metadata_simple(self):
         """Test metadata extraction from simple filename"""
         metadata = extract_metadata_from_filename("paper.pdf")
@@ -45,3 +66,54 @@ class TestUtils:
         output_path = ensure_output_path(input_path)
         assert output_path.suffix == ".epub"
         assert output_path.stem == "paper"
+
+    def test_load_mathjax_cached(self, tmp_path):
+        """Test that a cached MathJax bundle is read without downloading"""
+        (tmp_path / f"mathjax-{MATHJAX_VERSION}.js").write_bytes(b"cached")
+        with patch("urllib.request.urlopen") as mock_urlopen:
+            assert load_mathjax(cache_dir=tmp_path) == b"cached"
+        mock_urlopen.assert_not_called()
+
+    @pytest.mark.parametrize("content_length", ["6", None])
+    def test_load_mathjax_downloads_atomically(self, tmp_path, content_length):
+        """Test that a download is cached via a rename with no temp files left"""
+        response = MagicMock()
+        response.__enter__.return_value = response
+        response.read.return_value = b"script"
+        response.headers = {} if content_length is None else {"Content-Length": content_length}
+
+        with (
+            patch("urllib.request.urlopen", return_value=response),
+            patch("paper2epub.utils.os.replace", wraps=os.replace) as mock_replace,
+        ):
+            assert load_mathjax(cache_dir=tmp_path) == b"script"
+
+        cache_path = tmp_path / f"mathjax-{MATHJAX_VERSION}.js"
+        mock_replace.assert_called_once()
+        assert mock_replace.call_args.args[1] == cache_path
+        assert [p.name for p in tmp_path.iterdir()] == [cache_path.name]
+        assert cache_path.read_bytes() == b"script"
+
+    def test_load_mathjax_truncated(self, tmp_path):
+        """Test that a download shorter than Content-Length is not cached"""
+        response = MagicMock()
+        response.__enter__.return_value = response
+        response.read.return_value = b"scr"
+        response.headers = {"Content-Length": "6"}
+
+        with patch("urllib.request.urlopen", return_value=response):
+            assert load_mathjax(cache_dir=tmp_path) is None
+        assert not list(tmp_path.iterdir())
+
+    def test_load_mathjax_failure_remembered(self, tmp_path):
+        """Test that a failed download is not retried within the process"""
+        with patch("urllib.request.urlopen", side_effect=OSError("offline")) as mock_urlopen:
+            assert load_mathjax(cache_dir=tmp_path) is None
+            assert load_mathjax(cache_dir=tmp_path) is None
+        mock_urlopen.assert_called_once()
+
+    def test_load_mathjax_offline(self, tmp_path):
+        """Test that a failed download returns None"""
+        with patch("urllib.request.urlopen", side_effect=OSError("offline")):
+            assert load_mathjax(cache_dir=tmp_path) is None
+        assert not list(tmp_path.iterdir())